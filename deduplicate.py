@@ -1,29 +1,96 @@
 """Find and remove duplicate files.
 
 Usage: 
-    deduplicate.py PATH (build|index) [--light|--full]
-    deduplicate.py PATH (list|delete) SORT [-a] [-p] [-s]
+    deduplicate.py PATH build [--light|--full] [--jobs N] [--processes]
+            [--verify [--compare] | --memory MB] [--db] [--snapshot]
+            [--disk-order] [--chunks] [--xattr] [--resume] [--stats FILE]
+            [--profile DIR]
+    deduplicate.py PATH index [--light|--full] [--jobs N] [--processes] [--db]
+            [--memory MB] [--snapshot] [--disk-order] [--chunks] [--xattr]
+            [--resume] [--stats FILE] [--profile DIR] [--since PREVIOUS]
+    deduplicate.py PATH compact
+    deduplicate.py PATH watch [--interval SECONDS]
+    deduplicate.py PATH serve [--socket FILE]
+    deduplicate.py PATH list SORT [-a] [-p] [--jobs N] [--overlap PERCENT]
+    deduplicate.py PATH (delete|link|reflink) SORT [-a] [-p] [-s] [--jobs N]
     deduplicate.py PATH dirs
     deduplicate.py PATH clean
 
 Commands:
     build   Write a deduplicator_summary file identifying duplicate files 
     index   Write a deduplicator_index file listing all files 
+    compact Apply the deltas of each deduplicator_index file at PATH to it
+            and remove them
+    watch   Follow changes to files and keep the scan records of a
+            build --db current. Write the deduplicator_summary file every
+            interval, on SIGUSR1 and on exit (Linux only)
+    serve   Load the files listed in the index files and .deduplicator_db at
+            PATH once, and answer lookups of files by size and checksum on a
+            Unix socket until SIGINT or SIGTERM. The table, with the files
+            added and removed by clients, is saved to .deduplicator_served
+            on exit and loaded again while the index files did not change
     list    Sort and list the results in the deduplicator_summary file 
     delete  Sort and delete duplicates in the deduplicator_summary file 
-    clean   Remove .deduplicator_record and .deduplicator_record_prev 
-            files
+            and record them in a deduplicator_journal file. A delete, link
+            or reflink interrupted on the same summary resumes from the
+            journal
+    link    Sort and replace duplicates in the deduplicator_summary file
+            with hard links to the first primary copy
+    reflink Sort and replace duplicates in the deduplicator_summary file
+            with copy-on-write clones of the first primary copy (Linux,
+            btrfs and XFS only)
+    clean   Remove .deduplicator_record, .deduplicator_record_prev,
+            .deduplicator_db, .deduplicator_snapshot, .deduplicator_chunks,
+            .deduplicator_checkpoint and .deduplicator_served files
 
 Options:
     PATH    The directory to perform the operation.
     --light     Rebuild scan records. Use previous record data if found.
     --full  Rebuild scan records.
+    -j N, --jobs N  Number of directories to list, files to checksum, stat
+            for sorting, or delete and link concurrently. [default: 1]
+    --processes     Checksum files in a pool of processes instead of
+            threads.
+    --verify    Split duplicates by a BLAKE2b hash of their full contents.
+    --compare   Also compare verified duplicates byte for byte.
+    --db    Keep scan records in a single .deduplicator_db sqlite database
+            at PATH instead of a .deduplicator_record in each directory.
+    --memory MB     Keep the scan records and the files to checksum in
+            sorted run files in a temporary directory ($TMPDIR), holding
+            about MB of them in memory, and merge them into the summary,
+            instead of holding every file in memory. Can not be used with
+            --snapshot or --chunks.
+    --disk-order    Checksum files in order of their location on disk, and
+            drop the pages read from the page cache.
+    --chunks    Keep the content-defined chunks of large files in
+            .deduplicator_chunks at PATH. Files whose size and mtime did
+            not change are not read again, changed files are read in full.
+    --xattr     Cache the checksum of each file in its user.deduplicator
+            extended attribute, and reuse it while the size and mtime of the
+            file match (unless --full).
+    --resume    Reuse the checksums recorded in .deduplicator_checkpoint by
+            an interrupted build, for the files whose size and mtime match.
+    --since PREVIOUS    Also write the changes since the index file PREVIOUS
+            to a deduplicator_index.delta-<time> file.
+    --snapshot  Save the listing of the tree to .deduplicator_snapshot at
+            PATH, and reuse the saved entries of each directory whose mtime
+            did not change (unless --full). Files are still stat'ed.
+    --stats FILE    Write the elapsed time, file and byte counts, rates,
+            reused records and errors of each build phase to FILE as JSON.
+    --profile DIR   Profile each build phase with cProfile and write the
+            results to DIR/<phase>.prof.
+    --interval SECONDS  Seconds between writes of the deduplicator_summary
+            file while watching, if any file changed. [default: 60]
+    --socket FILE   Path of the Unix socket to serve on, instead of
+            .deduplicator_socket at PATH.
     SORT    Key by which to sort primary copies and duplicate copies of
             a file.
     -a, --all   Consider all paths with the lowest sort value a primary 
             location.
     -p, --printall  Print entries in duplicate list where all copies are
             primary.
+    --overlap PERCENT   Also list pairs of files sharing at least PERCENT
+            of their bytes in chunks found by build --chunks.
     -s, --suppress  Continues operation in case of file permission errors.
 
 SORT Keys (lowest value considered primary):
@@ -38,97 +105,207 @@ SORT Keys (lowest value considered primary):
 
 import os
 import sys
+import errno
 import filecmp
 import csv
+import json
 import zlib
-from collections import namedtuple
+import time
+import signal
+import shutil
+import asyncio
+import tempfile
+from collections import defaultdict, Counter
+from itertools import groupby
+from bisect import bisect_left
 from datetime import datetime
 from pathlib import Path
-from operator import itemgetter
-import yaml
 from docopt import docopt
 import dupfilters as df
+from duphash import HashExecutor, fileDigest, retryRead
+from dupindex import ScanIndex, SCAN_DATABASE
+from dupwatch import TreeWatcher
+from dupformat import (readRows, writeRows, readGroups, groupRows, mergeRows
+        , readHeader, writeDelta, readDelta, applyDelta)
+from dupdirs import dirFingerprints, findDupTrees, findSubsetDirs
+from duplink import linkFile, reflinkFile
+from dupjournal import ActionJournal
+from dupstats import BuildStats
+from dupsnapshot import TreeSnapshot, FileStat, loadSnapshot, SNAPSHOT_FILE
+from dupsort import RunSorter
+from dupschedule import diskOrder, diskKeys, adviseSequential, adviseDone
+from dupchunks import ChunkIndex, fileChunks, CHUNK_FILE
+import dupchunks
+from dupxattr import readCsum, writeCsum
+from dupscope import ScanScope
+from dupmodel import FileRecord, RECORD_FIELDNAMES
+from dupcheckpoint import HashCheckpoint, CHECKPOINT_FILE
+from dupserve import (LookupTable, loadTable, serveTable, SERVE_SNAPSHOT
+        , SERVE_SOCKET)
+from dupfiles import (SCAN_RECORD, PREV_SCAN_RECORD, CONFIG_FILE
+        , SCAN_SUMMARY, SCAN_INDEX, SCAN_JOURNAL
+        , SCAN_ERRORS, MERGED_ROWS, COMPACT_TEMP, PROGRAM_FILES
+        , ROOT_PROGRAM_PARTS)
 
-SCAN_RECORD = '.deduplicator_record'
-PREV_SCAN_RECORD = '.deduplicator_record_prev'
-CONFIG_FILE = 'deduplicate.ini'
-SCAN_SUMMARY = 'deduplicator_summary'
-SCAN_INDEX = 'deduplicator_index'
-PREV_SCAN_SUMMARY = 'deduplicator_summary_prev'
-PROGRAM_FILES = [SCAN_RECORD, PREV_SCAN_RECORD, CONFIG_FILE, SCAN_SUMMARY,
-        SCAN_INDEX, PREV_SCAN_SUMMARY]
-RECORD_FIELDNAMES = ['name', 'size', 'csum', 'm_time', 'dups']
 max_checksum_mb = 4
-FileRecord = namedtuple('FileRecord', RECORD_FIELDNAMES)
-COMMANDS = ['build', 'list', 'delete', 'dirs', 'clean']
+sample_checksum_kb = 64
+action_batch_size = 1000
+memory_sorters = 4
+COMMANDS = ['build', 'index', 'compact', 'watch', 'serve', 'list', 'delete'
+        , 'link', 'reflink', 'dirs', 'clean']
 
 class DupSummary():
     def __init__(self, path, cfg_path, p_flag=False, a_flag=False
-            , s_flag=False, d_flag=False):
+            , s_flag=False, action=None, jobs=1, groups=None):
         self.path = path
-        self.dup_list = self.readSummary() 
+        self.groups = groups
+        self.summary_path = os.path.join(path, SCAN_SUMMARY)
         self.filter_result = []
+        self.dup_trees = []
         self.dup_dirs = {}
         self.dup_filters = df.DupFilters(cfg_path)
         self.print_all = p_flag
         self.include_all = a_flag
         self.suppress_err = s_flag
-        self.delete = d_flag
+        self.action = action
+        self.executor = HashExecutor(jobs)
 
     def sumSize(self):
-        return ('{} unique files in {} paths'.format(len(self.dup_list)
-            , sum([len(paths) for _, _, paths in self.dup_list])))
-
-    def readSummary(self):
-        dup_dict = {}
-        with open(os.path.join(self.path,SCAN_SUMMARY), newline='') as s_file:
-            #yaml_obj = yaml.load_all(sum_file)
-            #unique_list = next(yaml_obj)
-            unique_list = yaml.load(s_file)
-            for path, size, csum in unique_list:
-                mergeFileDict(dup_dict, {(csum, size): [path]})   
-            #print(*dup_dict.items(), sep='\n')
-        return [(c, s, paths) for (c, s), paths in dup_dict.items()]
+        n_groups = 0
+        n_paths = 0
+        for _, _, paths in self.dupList():
+            n_groups += 1
+            n_paths += len(paths)
+        result = '{} unique files in {} paths'.format(n_groups, n_paths)
+        errors_path = os.path.join(self.path, SCAN_ERRORS)
+        if os.path.isfile(errors_path):
+            with open(errors_path, newline='') as errors_file:
+                n_errors = sum(1 for _ in errors_file)
+            result += ', {} files could not be read by the last build' \
+                    ' and are not listed (see {})'.format(n_errors
+                            , SCAN_ERRORS)
+        return result
+
+    def dupList(self):
+        """yield (csum, size, paths) for each group of duplicates in SCAN_SUMMARY
+
+        groups are read from the file one at a time, in order of size. If the
+        groups were given instead, e.g. by DupSummarizer.dupGroups, they are
+        returned, and can only be consumed once.
+        """
+        if self.groups is not None:
+            return self.groups
+        return readGroups(self.summary_path)
 
     def sortDups(self, sort_func_name):
+        """set filter_result to yield (prim_paths, paths, csum, size) for each
+        group
+
+        groups are sorted lazily, as filter_result is consumed. The sort key
+        of each path is computed once, for action_batch_size groups at a
+        time on the executor.
+        """
+        def filterResult():
+            for group_batch in batched(self.dupList(), action_batch_size):
+                sort_keys = dict(self.executor.map(path_sort_func
+                    , [(path, (path,), 0) for _, _, path_list in group_batch
+                        for path in path_list]))
+                for csum, size, path_list in group_batch:
+                    paths = sorted(path_list, key=lambda x: x.lower()
+                            , reverse=True)
+                    paths.sort(key=sort_keys.get, reverse=True)
+                    prim_paths = [paths.pop()]
+                    if self.include_all and \
+                            not all([sort_keys[path] == 1 for path in paths]):
+                        while len(paths) > 0 and (sort_keys[prim_paths[0]]
+                                == sort_keys[paths[-1]]):
+                            prim_paths.append(paths.pop())
+                    yield (prim_paths, paths, csum, size)
+
         if sort_func_name is None: return
         path_sort_func = self.dup_filters.sortBy(sort_func_name)
-
-        for csum, size, path_list in self.dup_list:
-            paths = sorted(path_list, key=lambda x: x.lower(), reverse=True)
-            paths.sort(key=path_sort_func, reverse=True)
-            prim_paths = [paths.pop()]
-            if self.include_all and \
-                    not all([path_sort_func(path) == 1 for path in paths]):
-                while len(paths) > 0 and (path_sort_func(prim_paths[0]) 
-                        == path_sort_func(paths[-1])):
-                    prim_paths.append(paths.pop())
-            self.filter_result.append((prim_paths, paths))
-        self.filter_result.sort(key=lambda x: x[0][0].lower())
+        self.filter_result = filterResult()
 
     def printSortResult(self):
-        for prim_paths, paths in self.filter_result:
-            if len(paths) > 0 or self.print_all:
-                print(*['prim: ' + path for path in prim_paths], sep='\n')
-            for path in paths:
-                print('dupl: ' + path, end=' ')
-                if self.delete:
-                    try:
-                        os.remove(path)
-                        print('[DELETED]')
-                    except FileNotFoundError:
-                        print('\ndeletion warning: could not find', path)
-                    except PermissionError:
-                        if self.suppress_err:
-                            print('[PERMISSION ERROR]')
-                        else:
-                            raise
+        """print each group of filter_result and apply the action to its
+        duplicates
+
+        the action runs on the executor for action_batch_size groups at a
+        time. Each result is written to the journal, paths done by an
+        interrupted run of the same action on the same summary are skipped. Unless suppress_err
+        is set, no action is started after the first error other than a file
+        not found, and the error is raised once the groups before it are
+        printed.
+        """
+        journal = None
+        errors = []
+        if self.action is not None:
+            journal = ActionJournal(os.path.join(self.path, SCAN_JOURNAL)
+                    , self.summary_path, self.action)
+        try:
+            for group_batch in batched(self.filter_result, action_batch_size):
+                results = {}
+                if journal is not None:
+                    for path, result in self.executor.map(applyAction
+                            , [(path, (self.action, prim_paths[0], path), 0)
+                                for prim_paths, paths, *_ in group_batch
+                                for path in paths if path not in journal.done]
+                            , stop=lambda: len(errors) > 0):
+                        results[path] = result
+                        journal.record(path, result[0])
+                        if result[1] is not None and not self.suppress_err \
+                                and not isinstance(result[1]
+                                    , FileNotFoundError):
+                            errors.append(result[1])
+                for prim_paths, paths, *_ in group_batch:
+                    self.printGroup(prim_paths, paths, results
+                            , journal.done if journal else {})
+        finally:
+            if journal is not None:
+                journal.close()
+
+    def printGroup(self, prim_paths, paths, results, done):
+        if len(paths) > 0 or self.print_all:
+            print(*['prim: ' + path for path in prim_paths], sep='\n')
+        for path in paths:
+            print('dupl: ' + path, end=' ')
+            if path in done:
+                print('[{} EARLIER]'.format(done[path]))
+            elif path in results:
+                status, error = results[path]
+                if isinstance(error, FileNotFoundError):
+                    print('\n{} warning: could not find'.format(
+                        'deletion' if self.action == 'delete' else 'link')
+                        , error.filename)
+                elif error is not None and not self.suppress_err:
+                    raise error
                 else:
-                    print('')
-            if len(paths) > 0 or self.print_all:
-                print('--')
+                    print('[{}]'.format(status))
+            else:
+                print('')
+        if len(paths) > 0 or self.print_all:
+            print('--')
+
+    def printOverlaps(self, min_fraction):
+        """print each pair of files in the CHUNK_FILE at path sharing at
+        least min_fraction of their chunks, with the bytes they share
+        """
+        chunk_index = ChunkIndex(self.path)
+        if not chunk_index.files:
+            print(CHUNK_FILE, 'not found in', self.path, 'build with --chunks')
+            return
+        for shared, fraction, path, other_path in chunk_index.overlaps(
+                min_fraction):
+            print('{:.0%} shared, {} bytes reclaimable:'.format(fraction
+                , shared))
+            print(' -', path)
+            print(' -', other_path)
 
     def printDupDirs(self):
+        for dir_list in self.dup_trees:
+            print('identical directories:')
+            for path in dir_list:
+                print(' -', path)
         for set_dir, subset_dirs in sorted(
                 self.dup_dirs.items(), key=lambda x: x[0]):
             print('{} has all the files at:'.format(set_dir))
@@ -136,131 +313,1282 @@ class DupSummary():
                 print(' -', path)
     
     def findDupDirs(self):
-        def compareFileDicts(dict_list):
-            '''list of tuples (x,y) where dir y has all files in dir x'''
-            def subsetDict(sub_dict, file_dict):
-                for key in sub_dict:
-                    if key in file_dict:
-                        continue
-                    else:
-                        return False
-                return True
-            dict_list.sort(key=lambda file_dict: len(file_dict[0]))
-            #print([len(file_dict[0]) for file_dict in dict_list])
-            dup_dirs = {}
-            while len(dict_list) > 1:
-                file_dict, path = dict_list.pop(0)
-                for other_dict, other_path in dict_list:
-                    if subsetDict(file_dict, other_dict):
-                        mergeFileDict(dup_dirs, {other_path: [path]})
-            return dup_dirs
-
-        subdir_cache = []
-        for _, _, path_list in self.dup_list:
-            dir_list = list(set(os.path.dirname(path) for path in path_list))
-            if len(dir_list) == 1:
-                continue
-            if any(dir_path in subdir_cache for dir_path in dir_list):
-                continue
+        """find identical directory trees and directories holding all the
+        files of other directories
 
-            file_dict_list = [(loadScanRecordAsDict(path), path) 
-                    for path in dir_list]
-            dup_dirs = compareFileDicts(file_dict_list)
-            if len(dup_dirs) > 0:
-                mergeFileDict(self.dup_dirs, dup_dirs)
-                subdir_cache.extend(list(set(sum(dup_dirs.values(), []))))
+        the scan records of the tree are read once, from the SCAN_DATABASE
+        at path if there is one.
+        """
+        if os.path.isfile(os.path.join(self.path, SCAN_DATABASE)):
+            scan_index = ScanIndex(self.path)
+            tree = scan_index.loadTree()
+            scan_index.close()
+        else:
+            tree = loadTree(TreeSnapshot(self.path, PROGRAM_FILES
+                , stat_files=False, root_ignore_parts=ROOT_PROGRAM_PARTS))
+        fingerprints, sizes = dirFingerprints(tree)
+        self.dup_trees = findDupTrees(tree, fingerprints, sizes)
+        self.dup_dirs = findSubsetDirs(tree, fingerprints)
         
 
 class DupSummarizer():
-    def __init__(self, path, rescan_mode, i_flag):
+    def __init__(self, path, rescan_mode, i_flag, jobs=1, processes=False
+            , v_flag=False, c_flag=False, db_flag=False, stats=None
+            , snapshot_flag=False, memory_mb=None, disk_order=False
+            , chunks_flag=False, xattr_flag=False, scope=None
+            , resume_flag=False):
         self.path = path
         self.rescan_mode = rescan_mode
         self.index_flag = i_flag
+        self.verify = v_flag
+        self.compare = c_flag
+        self.scan_index = ScanIndex(path) if db_flag else None
+        self.hash_executor = HashExecutor(jobs, processes)
+        self.stats = stats if stats is not None else BuildStats()
+        self.snapshot_flag = snapshot_flag
+        self.snapshot = None
+        self.memory_mb = memory_mb
+        self.disk_order = disk_order
+        self.chunks_flag = chunks_flag
+        self.xattr_flag = xattr_flag
+        self.scope = scope
+        self.resume = resume_flag
+        self.checkpoint = None
+        self.run_dir = None
+        self.dir_runs = None
+        self.row_runs = None
+        self.errors = {}
         #self.file_dict = {}
         
     def build(self):
+        try:
+            n_index_files = self.scan()
+            print('checking for duplicates')
+            with self.stats.phase('dup search') as counters:
+                local_rows = self.localRows(not self.index_flag 
+                        and n_index_files == 0)
+                print('adding externally indexed files')
+                if self.memory_mb is None:
+                    self.file_dict = self.mergeIndexes(local_rows)
+                    counters['files'] += sum(len(paths) 
+                            for paths in self.file_dict.values())
+                else:
+                    self.file_dict = None
+                    writeRows(os.path.join(self.path, MERGED_ROWS)
+                            , self.mergedRows(local_rows))
+                    if self.scan_index is None:
+                        self.writeScanRecords()
+        finally:
+            self.closeRuns()
+        self.checkpoint.remove()
+        if self.scan_index is not None:
+            self.scan_index.close()
+        if self.verify:
+            print('verifying duplicates')
+            with self.stats.phase('verify'):
+                self.verifyDups(self.index_paths)
+        print(self.writeErrors())
+
+    def dupGroups(self):
+        """scan path and return an iterator of (csum, size, paths) for each
+        group of duplicates, in order of size
+
+        the tree is scanned and checksummed as by build, then groups are
+        merged with the index files one at a time as the iterator is
+        consumed. They are neither kept in file_dict nor written to a
+        summary, and are not split by verifyDups.
+        """
+        n_index_files = self.scan()
+        local_rows = self.localRows(n_index_files == 0)
+        self.checkpoint.remove()
+        self.writeErrors()
+        groups = self.mergedGroups(local_rows)
+
+        def closingGroups():
+            try:
+                for csum, size, paths in groups:
+                    yield csum, size, sorted(paths)
+            finally:
+                self.closeRuns()
+                if self.scan_index is not None:
+                    self.scan_index.close()
+        return closingGroups()
+
+    def scan(self):
+        """collect the scan records of path and checksum the files which
+        may have duplicates
+
+        return the number of files listed in the index files. If memory_mb
+        is set, the records are kept in runs by externalScan instead.
+        """
+        if self.memory_mb is not None:
+            return self.externalScan()
+        print('reading externally indexed files')
+        with self.stats.phase('index load') as counters:
+            index_sizes = self.indexSizes()
+            counters['files'] += sum(index_sizes.values())
+        print('listing files')
+        with self.stats.phase('traverse') as counters:
+            self.snapshot = self.takeSnapshot()
+            counters['files'] += self.snapshot.numFiles()
+            counters['cache_hits'] += len(self.snapshot.reused_dirs)
+            self.countListingErrors()
         print('building scan records')
+        self.scan_records = {}
+        self.kept_records = set()
         self.recrScan(self.path)
-        print('checking for duplicates')
-        self.file_dict = self.recrDupSearch(self.path)
-        print('adding externally indexed files')
-        self.loadIndexes()
-
-    def loadIndexes(self):
-        index_list = [entry.name for entry in os.scandir(self.path) 
-                if SCAN_INDEX in entry.name]
-        for index_file in index_list:
-            with open(os.path.join(self.path, index_file), newline='') as s_file:
-                unique_list = yaml.load(s_file)
-                for path, size, csum in unique_list:
-                    mergeFileDict(self.file_dict, 
-                            {(csum, size): [os.path.join(index_file, path)]})   
+        self.stats.endProgress()
+        if self.scan_index is not None:
+            self.stats.counters('stat')['cache_hits'] += self.scan_index.reused
+        print('checksumming possible duplicates')
+        with self.stats.phase('hash'):
+            self.checkpoint = HashCheckpoint(self.path, csumAlgorithm()
+                    , self.resume)
+            try:
+                self.hashCandidates(index_sizes)
+            finally:
+                self.checkpoint.close()
+        self.stats.endProgress()
+        if self.chunks_flag:
+            print('chunking large files')
+            with self.stats.phase('chunk'):
+                self.updateChunks()
+            self.stats.endProgress()
+        return sum(index_sizes.values())
+
+    def closeRuns(self):
+        """remove the run files of externalScan, if any"""
+        if self.run_dir is not None:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+            self.run_dir = None
+
+    def runSorter(self):
+        """return a RunSorter of rows in their natural order, holding its
+        share of memory_mb, with its runs in the run_dir of externalScan
+        """
+        return RunSorter(self.memory_mb / memory_sorters, None, self.run_dir)
+
+    def externalScan(self):
+        """collect the scan records of path and checksum the files which
+        may have duplicates, as scan does, holding at most about memory_mb
+        of records in memory
+
+        return the number of files listed in the index files. Each record is
+        added to runs as soon as its directory is listed, and no record is
+        kept in scan_records: see externalRecords and externalHash. Once
+        checksummed, the records are in dir_runs, sorted by directory, and
+        the checksummed files in row_runs, sorted by rowKey, or saved to the
+        scan_index, which has no row_runs. The runs are removed by closeRuns.
+        """
+        self.run_dir = tempfile.mkdtemp(prefix='deduplicator_build_')
+        self.dir_runs = self.runSorter()
+        self.row_runs = self.runSorter() if self.scan_index is None else None
+        print('reading externally indexed files')
+        with self.stats.phase('index load') as counters:
+            n_index_files = sum(n for _, n in self.indexSizeCounts())
+            counters['files'] += n_index_files
+        self.checkpoint = HashCheckpoint(self.path, csumAlgorithm()
+                , self.resume, load=False)
+        try:
+            print('listing files and building scan records')
+            link_runs, n_records = self.externalRecords()
+            self.stats.endProgress()
+            print('checksumming possible duplicates')
+            with self.stats.phase('hash'):
+                self.externalHash(link_runs.sortedFile(), n_records)
+            link_runs.close()
+            self.stats.endProgress()
+        finally:
+            self.checkpoint.close()
+        if self.scan_index is not None:
+            self.stats.counters('stat')['cache_hits'] += self.scan_index.reused
+            print('reused {} checksums from {}'.format(
+                self.scan_index.reused, SCAN_DATABASE))
+            self.scan_index.saveRecords(((dir_path, fr_list) for dir_path, _
+                , fr_list in self.sortedDirRecords()), self.scopeActive())
+        return n_index_files
+
+    def externalRecords(self):
+        """list path with a lazy snapshot, and return a RunSorter of the
+        records of the non empty files and the number of records
+
+        the dirRecords of each directory are built as it is listed. A marker
+        row of the directory, and the records of its empty files, are added
+        to dir_runs. Other records are added as link rows (size, no_inode,
+        dev, inode, dir_path, i, name, csum, m_time, mtime_ns, inode, dev),
+        sorted by size and linkKey. If the checkpoint is resumed, records
+        first take the csum it saved for their path by joinCheckpoint.
+        """
+        link_runs = self.runSorter()
+        path_runs = self.runSorter() if self.checkpoint.resumed else None
+        self.snapshot = self.takeSnapshot()
+        listings = self.snapshot.walk()
+        n_dirs = n_records = 0
+        while True:
+            with self.stats.phase('traverse') as counters:
+                dir_path, listing = next(listings, (None, None))
+                self.countListingErrors()
+                if listing is None:
+                    break
+                counters['files'] += len(listing.files)
+            fr_list, kept = self.dirRecords(dir_path, listing)
+            self.dir_runs.add((dir_path, -1, 0, kept))
+            for i, fr in enumerate(fr_list):
+                if fr.size == 0:
+                    self.dir_runs.add((dir_path, i, 0, fr.name, fr.size
+                        , fr.csum, fr.m_time, fr.inode, fr.dev))
+                    continue
+                no_inode = fr.inode is None or fr.dev is None
+                file_stat = listing.stats.get(fr.name)
+                row = (fr.size, int(no_inode), 0 if no_inode else fr.dev
+                        , 0 if no_inode else fr.inode, dir_path, i, fr.name
+                        , fr.csum, fr.m_time, None if file_stat is None
+                        else file_stat.st_mtime_ns, fr.inode, fr.dev)
+                if path_runs is None:
+                    link_runs.add(row)
+                else:
+                    path_runs.add((os.path.relpath(os.path.join(dir_path
+                        , fr.name), self.path),) + row)
+            n_dirs += 1
+            n_records += len(fr_list)
+            self.stats.progress('scanned {} directories, {} files'.format(
+                n_dirs, self.stats.counters('stat')['files']))
+        if path_runs is not None:
+            self.joinCheckpoint(path_runs, link_runs)
+        return link_runs, n_records
+
+    def joinCheckpoint(self, path_runs, link_runs):
+        """add the link rows of path_runs, prefixed by their relative path,
+        to link_runs, with the csum the checkpoint saved for their path,
+        size and mtime if they have none
+
+        both the rows and the saved checksums are sorted by path and joined.
+        """
+        saved_runs = self.runSorter()
+        for saved_row in self.checkpoint.savedRows():
+            saved_runs.add(saved_row)
+        saved_rows = saved_runs.sortedRows()
+        saved = next(saved_rows, None)
+        counters = self.stats.counters('hash')
+        for rel_path, *row in path_runs.sortedRows():
+            csum = row[7]
+            while saved is not None and saved[0] <= rel_path:
+                if saved[0] == rel_path and csum is None \
+                        and tuple(saved[1:3]) == (row[0], row[8]):
+                    csum = saved[3]
+                    counters['cache_hits'] += 1
+                saved = next(saved_rows, None)
+            link_runs.add(tuple(row[:7]) + (csum,) + tuple(row[8:]))
+        saved_runs.close()
+        path_runs.close()
+
+    def pendingLinks(self, link_path):
+        """yield (sample, row) for the first link row of each inode without
+        a csum in the run file link_path which may have a duplicate
+
+        the rows of each size are read ahead to count its inodes and known
+        checksums, merged with the sizes of the index files, and decided as
+        by hashCandidates: sample is set if the file is compared by
+        sampleCrc32 first.
+        """
+        sample_size = sample_checksum_kb * 1024
+        index_counts = self.indexSizeCounts()
+        index_size, index_n = next(index_counts, (None, 0))
+        behind = groupby(RunSorter.readFile(link_path), key=lambda row: row[0])
+        for size, rows in groupby(RunSorter.readFile(link_path)
+                , key=lambda row: row[0]):
+            n_links = 0
+            known = False
+            for _, links in groupby(rows, key=linkKey):
+                n_links += 1
+                known = known or any(row[7] is not None for row in links)
+            while index_size is not None and index_size < size:
+                index_size, index_n = next(index_counts, (None, 0))
+            if index_size == size:
+                n_links += index_n
+                known = True
+            _, rows = next(behind)
+            if not self.index_flag and n_links < 2:
+                continue
+            sample = not self.index_flag and not known \
+                    and size > 2 * sample_size
+            for _, links in groupby(rows, key=linkKey):
+                links = list(links)
+                if all(row[7] is None for row in links):
+                    yield sample, links[0]
+
+    def externalHash(self, link_path, n_records):
+        """checksum the files of the link rows in the run file link_path
+        which may have a duplicate, as hashCandidates does
+
+        the files to sample and to checksum are found by pendingLinks, their
+        samples and the files to checksum are sorted in runs. Then each
+        record is added to dir_runs with the csum of its inode, and each
+        checksummed file to row_runs as (size, csum, path, no_inode, dev,
+        inode, dir_path, i).
+        """
+        sample_size = sample_checksum_kb * 1024
+        checked_size = max_checksum_mb * 1024 * 1024
+        counters = self.stats.counters('hash')
+        sample_runs = self.runSorter()
+        hash_runs = self.runSorter()
+        n_hash = 0
+
+        def addHash(row):
+            nonlocal n_hash
+            hash_runs.add(tuple(row[4:6]) + tuple(row))
+            n_hash += 1
+
+        def sampleTasks():
+            for sample, row in self.pendingLinks(link_path):
+                if sample:
+                    counters['bytes'] += 2 * sample_size
+                    yield row, (os.path.join(row[4], row[6]), row[0]
+                            , self.disk_order), 2 * sample_size
+                else:
+                    addHash(row)
+
+        for n_done, (row, sample) in enumerate(self.mapReads(sampleCrc32
+                , self.externalReadOrder(sampleTasks()), 'hash'), 1):
+            sample_runs.add((row[0], sample) + tuple(row))
+            self.stats.progress('sampled {} files'.format(n_done))
+        for _, rows in groupby(sample_runs.sortedRows()
+                , key=lambda row: row[:2]):
+            first = next(rows)
+            for row in rows:
+                if first is not None:
+                    addHash(first[2:])
+                    first = None
+                addHash(row[2:])
+        sample_runs.close()
+
+        def hashTasks():
+            for hash_row in hash_runs.sortedRows():
+                row = hash_row[2:]
+                n_bytes = min(checked_size, row[0])
+                counters['bytes'] += n_bytes
+                yield row, (os.path.join(row[4], row[6]), self.disk_order) \
+                        , n_bytes
+
+        print('checksumming {} of {} files'.format(n_hash, n_records))
+        csum_runs = self.runSorter()
+        for row, csum in self.mapReads(crc32, self.externalReadOrder(
+                hashTasks()), 'hash'):
+            size, _, _, _, dir_path, _, name, _, m_time, mtime_ns, inode \
+                    , dev = row
+            file_path = os.path.join(dir_path, name)
+            csum_runs.add(tuple(row[:6]) + (csum,))
+            self.checkpoint.record(os.path.relpath(file_path, self.path)
+                    , size, m_time, csum)
+            if self.xattr_flag:
+                writeCsum(file_path, TreeSnapshot.statFile(dir_path, name)
+                        if mtime_ns is None else FileStat(size, m_time
+                            , mtime_ns, inode, dev), csumAlgorithm(), csum)
+            counters['files'] += 1
+            self.stats.progress('checksummed {} of {} files'.format(
+                counters['files'], n_hash))
+        hash_runs.close()
+
+        csum_rows = csum_runs.sortedRows()
+        csum_row = next(csum_rows, None)
+        for key, links in groupby(RunSorter.readFile(link_path), key=linkKey):
+            links = list(links)
+            while csum_row is not None and linkKey(csum_row) < key:
+                csum_row = next(csum_rows, None)
+            if csum_row is not None and linkKey(csum_row) == key:
+                csum = csum_row[6]
+            else:
+                csum = next((row[7] for row in links if row[7] is not None)
+                        , None)
+            for size, no_inode, dev_key, inode_key, dir_path, i, name, _ \
+                    , m_time, _, inode, dev in links:
+                self.dir_runs.add((dir_path, i, 0, name, size, csum, m_time
+                    , inode, dev))
+                if self.row_runs is not None and csum is not None:
+                    self.row_runs.add((size, csum, os.path.join(dir_path
+                        , name), no_inode, dev_key, inode_key, dir_path, i))
+        csum_runs.close()
+
+    def externalReadOrder(self, tasks):
+        """return the tasks of externalHash in the order their files are
+        read, like readOrder
+
+        tasks are kept in order unless disk_order is set, then the files of
+        action_batch_size tasks at a time are located by
+        dupschedule.diskKeys and the tasks are sorted in runs.
+        """
+        if not self.disk_order:
+            return tasks
+        order_runs = self.runSorter()
+        for batch in batched(tasks, action_batch_size):
+            keys = diskKeys([(args[0], row[2], row[3])
+                for row, args, _ in batch], self.hash_executor
+                , self.stats.counters('hash'))
+            for key, (row, args, n_bytes) in zip(keys, batch):
+                order_runs.add(tuple(key) + (row, args, n_bytes))
+
+        def orderedTasks():
+            try:
+                for *_, row, args, n_bytes in order_runs.sortedRows():
+                    yield tuple(row), tuple(args), n_bytes
+            finally:
+                order_runs.close()
+        return orderedTasks()
+
+    def sortedDirRecords(self):
+        """yield (dir_path, kept, records) for each directory in the
+        dir_runs of externalScan, in order of path
+
+        kept is set if its SCAN_RECORD was used as is, and records iterates
+        its FileRecords, with their dups, in the order of dirRecords. Each
+        must be consumed before the next directory.
+        """
+        def records(rows):
+            for _, record_rows in groupby(rows, key=lambda row: row[1]):
+                _, _, _, name, size, csum, m_time, inode, dev = \
+                        next(record_rows)
+                dups_row = next(record_rows, None)
+                yield FileRecord(name, size, csum, m_time
+                        , dups_row[3] if dups_row is not None else []
+                        , inode, dev)
+
+        try:
+            for dir_path, rows in groupby(self.dir_runs.sortedRows()
+                    , key=lambda row: row[0]):
+                _, _, _, kept = next(rows)
+                yield dir_path, kept, records(rows)
+        finally:
+            self.dir_runs.close()
+
+    def localRows(self, dups_only):
+        """return an iterator of the rows of the checksummed files of
+        scan_records, sorted by rowKey
+
+        only files with a duplicate in scan_records are included if dups_only
+        is set. With a csv backend, the scan records are written before
+        returning, or once the rows are consumed if memory_mb is set.
+        """
+        if self.scan_index is not None:
+            return self.scan_index.sortedRows(not dups_only)
+        if self.memory_mb is not None:
+            return self.externalRows(dups_only)
+        buckets = self.bucketRecords()
+        self.saveScanRecords(buckets)
+        return self.bucketRows(buckets, dups_only)
+
+    def takeSnapshot(self):
+        """return a TreeSnapshot of path
+
+        files with a SCAN_RECORD which is used as is or by name are not
+        stat'ed. If snapshot_flag is set, the listings saved by the last run
+        are reused unless rescan_mode is 'full'. Files and directories are
+        left out by scope as they are listed. If memory_mb is set, the
+        snapshot is lazy.
+        """
+        stat_unless = [SCAN_RECORD] if self.scan_index is None \
+                and self.rescan_mode != 'full' else []
+        saved = loadSnapshot(self.path, self.scope) if self.snapshot_flag \
+                and self.rescan_mode != 'full' else None
+        return TreeSnapshot(self.path, PROGRAM_FILES
+                , self.hash_executor.jobs, stat_unless=stat_unless
+                , saved=saved, scope=self.scope
+                , root_ignore_parts=ROOT_PROGRAM_PARTS
+                , lazy=self.memory_mb is not None)
+
+    def countListingErrors(self):
+        """count the skipped entries and quarantine the errors of the
+        directories listed by snapshot so far
+        """
+        while self.snapshot.skipped:
+            self.countSkipped(*self.snapshot.skipped.pop())
+        while self.snapshot.errors:
+            dir_path, error = self.snapshot.errors.pop()
+            self.quarantine(dir_path, error, 'traverse')
+
+    def scopeActive(self):
+        """return True if [scan] rules may leave files out of the build"""
+        return self.scope is not None and self.scope.active
+
+    def countSkipped(self, n_pruned=0, n_files=0, n_bytes=0):
+        """add directories and files left out by scope to the traverse
+        counters
+        """
+        counters = self.stats.counters('traverse')
+        counters['pruned_dirs'] = counters.get('pruned_dirs', 0) + n_pruned
+        counters['skipped_files'] = counters.get('skipped_files', 0) \
+                + n_files
+        counters['skipped_bytes'] = counters.get('skipped_bytes', 0) \
+                + n_bytes
+
+    def saveSnapshot(self, summary_name):
+        """save snapshot, after summary_name was written to path"""
+        self.snapshot.refreshDir(self.path, [summary_name])
+        self.snapshot.save()
+
+    def indexChains(self):
+        """return a list of (index_file, delta_files) for the index files
+        at path
+
+        index files are the files whose name contains SCAN_INDEX. A delta
+        file applies to the index file or delta whose rows have its base
+        digest, deltas applying to no index file are ignored. No index file
+        is used when building an index.
+        """
+        if self.index_flag:
+            return []
+        index_files = []
+        deltas = {}
+        for name in sorted(entry.name for entry in os.scandir(self.path)
+                if SCAN_INDEX in entry.name and entry.is_file()):
+            header = readHeader(os.path.join(self.path, name))
+            if header[0] == 'delta':
+                deltas[header[1]] = (name, header[2])
+            else:
+                index_files.append((name, header[1]))
+        chains = []
+        for name, digest in index_files:
+            delta_files = []
+            while digest in deltas:
+                delta_file, digest = deltas.pop(digest)
+                delta_files.append(delta_file)
+            chains.append((name, delta_files))
+        for delta_file, _ in deltas.values():
+            print('index warning: no index file for', delta_file)
+        return chains
+
+    def indexFiles(self):
+        return [index_file for index_file, _ in self.indexChains()]
+
+    def chainRows(self, index_file, delta_files):
+        """yield the rows of index_file with each of delta_files applied"""
+        mismatch = [0]
+        rows = readRows(os.path.join(self.path, index_file))
+        for delta_file in delta_files:
+            rows = applyDelta(rows, readDelta(os.path.join(self.path
+                , delta_file)), mismatch)
+        yield from rows
+        if mismatch[0] > 0:
+            print('index warning: {} changes of {} did not match {}'.format(
+                mismatch[0], ', '.join(delta_files), index_file))
+
+    def indexRows(self, index_file, delta_files=()):
+        """yield the rows of index_file and its delta_files with paths
+        prefixed by its name
+        """
+        for path, size, csum, *_ in self.chainRows(index_file, delta_files):
+            yield (os.path.join(index_file, path), size, csum)
+
+    def indexSizes(self):
+        """return a Counter of the file sizes listed in all index files"""
+        return Counter(dict(self.indexSizeCounts()))
+
+    def indexSizeCounts(self):
+        """yield (size, n) for each file size listed n times in the index
+        files, in order of size
+
+        the rows of all index files are merged, one row at a time.
+        """
+        rows = mergeRows(*[self.indexRows(index_file, delta_files)
+            for index_file, delta_files in self.indexChains()])
+        for size, group in groupby(rows, key=lambda row: row[1]):
+            yield size, sum(1 for _ in group)
+
+    def compactIndexes(self):
+        """rewrite each index file with its deltas applied and remove them
+
+        an index file is only replaced if its new rows have the digest of
+        its last delta.
+        """
+        for index_file, delta_files in self.indexChains():
+            if len(delta_files) == 0:
+                continue
+            index_path = os.path.join(self.path, index_file)
+            temp_path = os.path.join(self.path, COMPACT_TEMP)
+            digest = writeRows(temp_path, self.chainRows(index_file
+                , delta_files))
+            if digest != readHeader(os.path.join(self.path
+                    , delta_files[-1]))[2]:
+                print('compact warning: {} does not match {}, kept'.format(
+                    index_file, delta_files[-1]))
+                os.remove(temp_path)
+                continue
+            os.replace(temp_path, index_path)
+            for delta_file in delta_files:
+                os.remove(os.path.join(self.path, delta_file))
+            print('applied {} to {}'.format(', '.join(delta_files)
+                , index_file))
+
+    def writeIndexDelta(self, prev_path):
+        """write the changes from the index file prev_path to the rows of
+        file_dict to a delta file at path
+        """
+        delta_name = '{}.delta-{}'.format(SCAN_INDEX
+                , datetime.now().strftime('%Y%m%d%H%M%S'))
+        if self.file_dict is None:
+            new_rows = readRows(os.path.join(self.path, MERGED_ROWS))
+        else:
+            new_rows = fileDictRows(self.file_dict)
+        with self.stats.phase('summary write'):
+            _, _, n_changes = writeDelta(os.path.join(self.path, delta_name)
+                    , readRows(prev_path), new_rows)
+        return 'wrote {} changes since {} to {}'.format(n_changes, prev_path
+                , delta_name)
+
+    def mergeIndexes(self, local_rows):
+        """return a dict of local_rows merged with the rows of all index files
+
+        local_rows must be sorted by rowKey. The rows of each index file are
+        merged one group at a time. Keys in dict are tuples (file_chksum,
+        file_size) and values are lists of paths. Only groups of more than one
+        path are kept unless building an index. index_paths is set to the
+        index file paths kept.
+        """
+        file_dict = {}
+        self.index_paths = set()
+        index_chains = self.indexChains()
+        index_files = [index_file for index_file, _ in index_chains]
+        row_iters = [self.indexRows(index_file, delta_files)
+                for index_file, delta_files in index_chains]
+        for csum, size, paths in groupRows(mergeRows(local_rows, *row_iters)):
+            if len(paths) > 1 or self.index_flag:
+                file_dict[csum, size] = paths
+                if len(index_files) > 0:
+                    self.index_paths.update(path for path in paths
+                        if path.split(os.sep, 1)[0] in index_files)
+        return file_dict
+
+    def mergedGroups(self, local_rows):
+        """return an iterator of (csum, size, paths) for each group of
+        local_rows merged with the rows of all index files
+
+        groups are merged one at a time, so no dict of all groups is built.
+        Like mergeIndexes, only groups of more than one path are kept unless
+        building an index.
+        """
+        counters = self.stats.counters('dup search')
+        row_iters = [self.indexRows(index_file, delta_files)
+                for index_file, delta_files in self.indexChains()]
+
+        def groups():
+            for csum, size, paths in groupRows(mergeRows(local_rows
+                    , *row_iters)):
+                if len(paths) > 1 or self.index_flag:
+                    counters['files'] += len(paths)
+                    yield csum, size, paths
+        return groups()
+
+    def mergedRows(self, local_rows):
+        """yield the rows of local_rows merged with the rows of all index
+        files, like fileDictRows yields the rows of mergeIndexes
+        """
+        for csum, size, paths in self.mergedGroups(local_rows):
+            for path in sorted(paths):
+                yield (path, size, csum)
             
     def recrScan(self, path):
-        """store a csv SCAN_RECORD at path and in all of its subdirectories
+        """collect the dirRecords of path and all of its subdirectories in
+        scan_records
+        """
+        listing = self.snapshot.dirs[path]
+        for name in listing.subdirs:
+            if os.path.join(path, name) in self.snapshot.dirs:
+                self.recrScan(os.path.join(path, name))
+        fr_list, kept = self.dirRecords(path, listing)
+        if kept:
+            self.kept_records.add(path)
+        self.scan_records[path] = fr_list
+        self.stats.progress('scanned {} directories, {} files'.format(
+            len(self.scan_records), self.stats.counters('stat')['files']))
+
+    def dirRecords(self, path, listing):
+        """return a list of FileRecords for directory path with listing, and
+        whether its SCAN_RECORD was used as is
 
-        fields defined by RECORD_FIELDNAMES, rows list each file located in the
-        directory. dups field is not populated. Use existing SCAN_RECORDs
-        according to instance rescan_mode:
+        fields defined by RECORD_FIELDNAMES, one record for each file located
+        in the directory, sorted by size. csum field is not populated (see
+        hashCandidates) and dups field is not populated. Use existing SCAN_RECORDs according to
+        instance rescan_mode:
         'none' - use any found scan record as current
         'light' - check whether dir files exist in SCAN_RECORD, if so copy
             the entry
         'full' - don't use existing SCAN_RECORD
+        With a scan_index, no SCAN_RECORD is read. Unless rescan_mode is
+        'full', checksums of files with a matching database row, or with a
+        matching xattr if xattr_flag is set, are reused.
+        Directories and stat results are taken from snapshot. Reading records
+        and building them is timed as the stat phase of stats.
         """
-        def buildRecordList(f_list, path):
-            print('building record for {}[{} files]'.format(path, len(f_list)))
-            return [fileData(entry) for entry in f_list]
-
-        dir_list, file_list, sym_list = scanDir(path)
-        for dir_entry in dir_list:
-            self.recrScan(dir_entry.path)
-
-        dedup_record_path = os.path.join(path, SCAN_RECORD)
-        if os.path.isfile(dedup_record_path):
-            if self.rescan_mode == 'none':
-                print(dedup_record_path, '\n\tfound! using previous results')
-                return
-            elif self.rescan_mode == 'light':
-                fr_list = []
-                sr_dict = loadScanRecordAsNameDict(path)
-                for dir_entry in file_list:
-                    if dir_entry.name in sr_dict:
-                        size, csum, mtime, _ = sr_dict[dir_entry.name]
-                        fr_list.append(FileRecord(
-                            dir_entry.name, size, csum, mtime, []))
-                    else:
-                        print('no entry for', dir_entry.name)
-                        fr_list.append(fileData(dir_entry))
-            elif self.rescan_mode == 'full':
-                fr_list = buildRecordList(file_list, path)
-            old_path = os.path.join(path, PREV_SCAN_RECORD)
-            os.replace(dedup_record_path, old_path)
-        else:
-            fr_list = buildRecordList(file_list, path)
+        def buildRecordList(names):
+            fr_list = [fileData(name, self.snapshot.fileStat(path, name)
+                , self.scan_index, self.rescan_mode != 'full'
+                , self.xattrPath(path, name)) for name in names]
+            if self.xattr_flag and self.scan_index is None:
+                counters['cache_hits'] += sum(1 for fr in fr_list
+                        if fr.size > 0 and fr.csum is not None)
+            return fr_list
 
+        kept = False
+        with self.stats.phase('stat') as counters:
+            counters['files'] += len(listing.files)
+            if self.scan_index is not None:
+                fr_list = buildRecordList(listing.files)
+            elif SCAN_RECORD in listing.program_files:
+                if self.rescan_mode == 'none':
+                    fr_list = loadScanRecord(path)
+                    kept = True
+                    counters['cache_hits'] += len(fr_list)
+                elif self.rescan_mode == 'light':
+                    fr_list = []
+                    sr_dict = loadScanRecordAsNameDict(path)
+                    dev = listing.dir_stat.st_dev
+                    for name, inode in listing.files.items():
+                        if name in sr_dict:
+                            size, csum, mtime, _ = sr_dict[name]
+                            fr_list.append(FileRecord(name, size, csum
+                                , mtime, [], inode, dev))
+                            counters['cache_hits'] += 1
+                        else:
+                            print('no entry for', name)
+                            fr_list.append(fileData(name
+                                , self.snapshot.fileStat(path, name)
+                                , file_path=self.xattrPath(path, name)))
+                elif self.rescan_mode == 'full':
+                    fr_list = buildRecordList(listing.files)
+            else:
+                fr_list = buildRecordList(listing.files)
+        if self.scopeActive():
+            rel_dir = os.path.relpath(path, self.path) \
+                    if path != self.path else ''
+            scope_list = []
+            n_skipped = n_bytes = 0
+            for fr in fr_list:
+                if not self.scope.skipFile(os.path.join(rel_dir, fr.name)) \
+                        and not self.scope.skipSize(fr.size):
+                    scope_list.append(fr)
+                elif fr.name in listing.files:
+                    # files the listing left out were counted by snapshot
+                    n_skipped += 1
+                    n_bytes += fr.size
+            self.countSkipped(n_files=n_skipped, n_bytes=n_bytes)
+            fr_list = scope_list
         fr_list.sort(key=lambda x: x.size)
-        self.listToFile(dedup_record_path, fr_list)
+        return fr_list, kept
 
-    def writeSummary(self):
-        def toList(dict_pair):
-            (chksm, size), paths = dict_pair
-            return [(path, size, chksm) for path in paths]
+    def hashCandidates(self, index_sizes):
+        """checksum the files in scan_records which may have a duplicate
 
-        file_list = []
-        if self.index_flag:
-            summary_name = SCAN_INDEX
-            for dict_pair in self.file_dict.items():
-                file_list.extend(toList(dict_pair))
+        Then store scan_records in the scan_index if there is one. Files are
+        bucketed by size first: a file whose size is not shared with any other
+        record or with an entry of index_sizes is never read, and is saved
+        without a csum. Files sharing their size only with other unchecksummed
+        files larger than two samples are compared with sampleCrc32 before the
+        full crc32. Every file is checksummed when building an index, since
+        its duplicates may be in another tree. Files are read concurrently by
+        hash_executor, results are stored by position so records do not
+        depend on the order reads complete. Hard links to one inode count as
+        a single file and are read once. Each checksum is recorded to the
+        checkpoint, and checksums it saved are reused. Files which can not be
+        read are quarantined and left without a csum.
+        """
+        def filePath(entry):
+            path, i = entry
+            return os.path.join(path, self.scan_records[path][i].name)
+
+        def setCsum(entries, csum):
+            for path, i in entries:
+                fr_list = self.scan_records[path]
+                fr_list[i] = fr_list[i]._replace(csum=csum)
+
+        sample_size = sample_checksum_kb * 1024
+        checked_size = max_checksum_mb * 1024 * 1024
+        size_count = Counter(index_sizes)
+        known_sizes = set(size_count)
+        inode_dict = defaultdict(list)
+        for path, fr_list in self.scan_records.items():
+            for i, fr in enumerate(fr_list):
+                if fr.size > 0:
+                    inode_dict[inodeKey(path, i, fr)].append((path, i))
+        pending = defaultdict(list)
+        links = {}
+        counters = self.stats.counters('hash')
+        for entries in inode_dict.values():
+            path, i = entries[0]
+            fr = self.scan_records[path][i]
+            size = fr.size
+            csums = [self.scan_records[path][i].csum for path, i in entries
+                    if self.scan_records[path][i].csum is not None]
+            if len(csums) == 0 and self.checkpoint.saved:
+                saved_csum = self.checkpoint.csum(os.path.relpath(filePath(
+                    entries[0]), self.path), size, fr.m_time)
+                if saved_csum is not None:
+                    csums.append(saved_csum)
+                    counters['cache_hits'] += 1
+            size_count[size] += 1
+            if len(csums) > 0:
+                known_sizes.add(size)
+                setCsum(entries, csums[0])
+            else:
+                pending[size].append(entries[0])
+                links[entries[0]] = entries
+        del inode_dict
+
+        hash_list = []
+        sample_tasks = []
+        for size, entries in pending.items():
+            if self.index_flag:
+                hash_list.extend(entries)
+            elif size_count[size] < 2:
+                continue
+            elif size in known_sizes or size <= 2 * sample_size:
+                hash_list.extend(entries)
+            else:
+                sample_tasks.extend((entry, (filePath(entry), size
+                    , self.disk_order), 2 * sample_size) for entry in entries)
+
+        sample_tasks = self.readOrder(sample_tasks)
+        counters['bytes'] += sum(n_bytes for _, _, n_bytes in sample_tasks)
+        sample_dict = defaultdict(list)
+        for n_done, (entry, sample) in enumerate(self.mapReads(
+                sampleCrc32, sample_tasks, 'hash'), 1):
+            path, i = entry
+            sample_dict[self.scan_records[path][i].size, sample].append(entry)
+            self.stats.progress('sampled {} of {} files'.format(
+                n_done, len(sample_tasks)))
+        for sample_entries in sample_dict.values():
+            if len(sample_entries) > 1:
+                hash_list.extend(sample_entries)
+
+        print('checksumming {} of {} files'.format(len(hash_list)
+            , sum(len(fr_list) for fr_list in self.scan_records.values())))
+        hash_tasks = self.readOrder([(entry, (filePath(entry)
+            , self.disk_order), min(checked_size
+            , self.scan_records[entry[0]][entry[1]].size))
+            for entry in sorted(hash_list)])
+        counters['bytes'] += sum(n_bytes for _, _, n_bytes in hash_tasks)
+        for entry, csum in self.mapReads(crc32, hash_tasks, 'hash'):
+            setCsum(links[entry], csum)
+            path, i = entry
+            fr = self.scan_records[path][i]
+            self.checkpoint.record(os.path.relpath(filePath(entry), self.path)
+                    , fr.size, fr.m_time, csum)
+            if self.xattr_flag:
+                writeCsum(filePath(entry), self.snapshot.fileStat(path
+                    , fr.name), csumAlgorithm(), csum)
+            counters['files'] += 1
+            self.stats.progress('checksummed {} of {} files'.format(
+                counters['files'], len(hash_tasks)))
+
+        if self.scan_index is not None:
+            print('reused {} checksums from {}'.format(
+                self.scan_index.reused, SCAN_DATABASE))
+            self.scan_index.saveRecords(self.scan_records.items()
+                    , self.scopeActive())
+
+    def mapReads(self, func, tasks, phase, path_arg=0):
+        """yield (key, result) of each (key, args, n_bytes) of tasks for
+        which func(*args) could read its file, as hash_executor.map does
+
+        each read is tried again by retryRead, the file of the reads which
+        still fail, args[path_arg], is quarantined as an error of phase.
+        The path is taken from the task, since the errors raised by a read
+        rather than an open have no filename.
+        """
+        for (key, path), (result, error) in self.hash_executor.map(retryRead
+                , (((key, args[path_arg]), (func,) + args, n_bytes)
+                    for key, args, n_bytes in tasks)):
+            if error is None:
+                yield key, result
+            else:
+                self.quarantine(path, error, phase)
+
+    def quarantine(self, path, error, phase):
+        """keep the error of a file or directory which could not be read,
+        counted in the errors of phase, for writeErrors
+        """
+        self.errors[path] = '{}: {}'.format(type(error).__name__
+                , error.strerror or error)
+        self.stats.counters(phase)['errors'] += 1
+        print('read error:', path, '({})'.format(error.strerror or error))
+
+    def writeErrors(self):
+        """write the quarantined errors to SCAN_ERRORS at path, one JSON
+        array [path, error] per line, or remove it if there are none
+
+        files listed are retried by the next build.
+        """
+        errors_path = os.path.join(self.path, SCAN_ERRORS)
+        if not self.errors:
+            if os.path.isfile(errors_path):
+                os.remove(errors_path)
+            return 'no read errors'
+        with open(errors_path, 'w', newline='') as errors_file:
+            for path, error in sorted(self.errors.items()
+                    , key=lambda item: str(item[0])):
+                errors_file.write(json.dumps([path, error]) + '\n')
+        return '{} files could not be read, listed in {}'.format(
+                len(self.errors), SCAN_ERRORS)
+
+    def updateChunks(self):
+        """update the CHUNK_FILE at path with the chunks of each file in
+        scan_records of at least dupchunks.min_file_mb
+
+        files are chunked concurrently by hash_executor, and reuse the chunks
+        saved for them where they did not change. Files which can not be read
+        are quarantined, and like files no longer found are dropped from
+        CHUNK_FILE.
+        """
+        chunk_index = ChunkIndex(self.path)
+        min_size = dupchunks.min_file_mb * 1024 * 1024
+        tasks = []
+        for path, fr_list in self.scan_records.items():
+            for fr in fr_list:
+                if fr.size >= min_size:
+                    rel_path = os.path.relpath(os.path.join(path, fr.name)
+                            , self.path)
+                    tasks.append((rel_path, (os.path.join(path, fr.name)
+                        , fr.size, fr.m_time, chunk_index.files.get(rel_path))
+                        , fr.size))
+        counters = self.stats.counters('chunk')
+        files = {}
+        for rel_path, (size, m_time, chunks, n_read, n_reused) in \
+                self.mapReads(fileChunks, tasks, 'chunk'):
+            files[rel_path] = (size, m_time, chunks)
+            counters['files'] += 1
+            counters['bytes'] += n_read
+            counters['cache_hits'] += n_reused
+            self.stats.progress('chunked {} of {} files'.format(
+                counters['files'], len(tasks)))
+        chunk_index.files = files
+        chunk_index.save()
+
+    def xattrPath(self, path, name):
+        """return the path of file name in path if its xattr is read"""
+        if self.xattr_flag and self.rescan_mode != 'full':
+            return os.path.join(path, name)
+        return None
+
+    def readOrder(self, tasks):
+        """return the HashExecutor tasks of hashCandidates in the order their
+        files are read
+
+        tasks are kept in order unless disk_order is set, then they are sorted
+        by dupschedule.diskOrder.
+        """
+        if not self.disk_order:
+            return tasks
+        def taskEntry(task):
+            (path, i), args, _ = task
+            fr = self.scan_records[path][i]
+            return (task, args[0], fr.dev, fr.inode)
+
+        return [task for task, _, _, _ in diskOrder([taskEntry(task)
+            for task in tasks], self.hash_executor
+            , self.stats.counters('hash'))]
+
+    def bucketRecords(self):
+        """return a dict of every checksummed file in scan_records
+
+        Keys in dict are tuples (file_chksum, file_size) and values are lists
+        of (path, i) ids of the record i of directory path. Empty files are
+        excluded. Hard links to one inode are a single file: only the first
+        of their paths is kept.
+        """
+        buckets = defaultdict(list)
+        for path, fr_list in self.scan_records.items():
+            for i, fr in enumerate(fr_list):
+                if fr.size > 0 and fr.csum is not None:
+                    buckets[fr.csum, fr.size].append((path, i))
+        for key, entries in buckets.items():
+            if len(entries) > 1:
+                buckets[key] = self.collapseLinks(entries)
+        return buckets
+
+    def collapseLinks(self, entries):
+        """return the (path, i) entries sorted by path, keeping only the
+        first path of hard links to one inode
+        """
+        inode_set = set()
+        link_entries = []
+        for path, i in sorted(entries, key=lambda entry: os.path.join(
+                entry[0], self.scan_records[entry[0]][entry[1]].name)):
+            inode_key = inodeKey(path, i, self.scan_records[path][i])
+            if inode_key not in inode_set:
+                inode_set.add(inode_key)
+                link_entries.append((path, i))
+        return link_entries
+
+    def externalRows(self, dups_only=False):
+        """yield a row for each checksummed file in the row_runs of
+        externalScan, sorted by dupformat.rowKey
+
+        like bucketRows of bucketRecords, but the rows are read back from the
+        runs one group at a time, and only the first path of hard links to
+        one inode is kept in a group. The dups of the records of each group
+        of duplicates are added to dir_runs, as saveScanRecords sets them.
+        """
+        try:
+            for (size, csum), group in groupby(self.row_runs.sortedRows()
+                    , key=lambda row: row[:2]):
+                inode_set = set()
+                path_list = []
+                for _, _, path, no_inode, dev, inode, dir_path, i in group:
+                    inode_key = (dir_path, i) if no_inode else (dev, inode)
+                    if inode_key not in inode_set:
+                        inode_set.add(inode_key)
+                        path_list.append((path, dir_path, i))
+                if len(path_list) > 1:
+                    for dir_path, i, dups in pathDups(path_list):
+                        self.dir_runs.add((dir_path, i, 1, dups))
+                if len(path_list) > 1 or not dups_only:
+                    for path, _, _ in path_list:
+                        yield (path, size, csum)
+        finally:
+            self.row_runs.close()
+
+    def bucketRows(self, buckets, dups_only=False):
+        """yield a row for each file in buckets, sorted by dupformat.rowKey
+
+        if dups_only is set, buckets of a single file are skipped.
+        """
+        for (csum, size), entries in sorted(buckets.items()
+                , key=lambda item: (item[0][1], item[0][0])):
+            if len(entries) > 1 or not dups_only:
+                for path in sorted(os.path.join(dir_path
+                        , self.scan_records[dir_path][i].name) 
+                        for dir_path, i in entries):
+                    yield (path, size, csum)
+
+    def saveScanRecords(self, buckets):
+        """store each list in scan_records as a csv SCAN_RECORD
+
+        dups field of each record lists the paths, relative to its directory,
+        of the files in its bucket located in a subdirectory of its directory.
+        """
+        for entries in buckets.values():
+            if len(entries) > 1:
+                self.setDups(entries)
+        self.writeScanRecords()
+
+    def setDups(self, entries):
+        """extend the dups field of the records of a bucket of (path, i)"""
+        for dir_path, i, dups in pathDups([(os.path.join(dir_path
+            , self.scan_records[dir_path][i].name), dir_path, i)
+            for dir_path, i in entries]):
+            self.scan_records[dir_path][i].addDups(dups)
+
+    def writeScanRecords(self):
+        """store each list in scan_records, or each directory of the
+        dir_runs of externalScan, as a csv SCAN_RECORD
+        """
+        if self.memory_mb is None:
+            dir_records = ((path, path in self.kept_records, fr_list)
+                    for path, fr_list in self.scan_records.items())
         else:
-            summary_name = SCAN_SUMMARY
-            for f_data, dups in self.file_dict.items():
-                if len(dups) > 1:
-                    file_list.extend(toList((f_data, dups)))
-            file_list.sort(key=itemgetter(1), reverse=True)
+            dir_records = self.sortedDirRecords()
+        for path, kept, fr_list in dir_records:
+            dedup_record_path = os.path.join(path, SCAN_RECORD)
+            written_names = [SCAN_RECORD]
+            if not kept and os.path.isfile(dedup_record_path):
+                old_path = os.path.join(path, PREV_SCAN_RECORD)
+                os.replace(dedup_record_path, old_path)
+                written_names.append(PREV_SCAN_RECORD)
+            self.listToFile(dedup_record_path, fr_list)
+            if self.snapshot_flag:
+                self.snapshot.refreshDir(path, written_names)
+
+    def verifyDups(self, index_paths):
+        """split each group of duplicates in file_dict by full file contents
+
+        each file in a group is hashed with fileDigest, and each group of
+        identical digests is keyed by (csum, size, digest). If compare is set,
+        files are also compared byte for byte with the first file of their
+        group. Files in index_paths can not be read and are added to every
+        group of their (csum, size). Files failing to read are quarantined and
+        dropped from their group. Groups left with a single path are dropped.
+        """
+        dup_keys = [key for key, paths in self.file_dict.items() 
+                if len(paths) > 1 and key[0] is not None]
+        digest_tasks = [((key, path), (path,), key[1]) for key in dup_keys 
+                for path in sorted(self.file_dict[key]) 
+                if path not in index_paths]
+        print('hashing {} files in {} groups'.format(
+            len(digest_tasks), len(dup_keys)))
+        counters = self.stats.counters('verify')
+        counters['files'] += len(digest_tasks)
+        counters['bytes'] += sum(n_bytes for _, _, n_bytes in digest_tasks)
+        digest_dict = defaultdict(list)
+        for (key, path), digest in self.mapReads(fileDigest, digest_tasks
+                , 'verify'):
+            digest_dict[key + (digest,)].append(path)
+
+        if self.compare:
+            for paths in digest_dict.values():
+                paths.sort()
+            compare_tasks = [((digest_key, path), (paths[0], path, False)
+                , 2 * digest_key[1]) for digest_key, paths 
+                in digest_dict.items() for path in paths[1:]]
+            for paths in digest_dict.values():
+                del paths[1:]
+            for (digest_key, path), same in self.mapReads(filecmp.cmp
+                    , compare_tasks, 'verify', path_arg=1):
+                if same:
+                    digest_dict[digest_key].append(path)
+                else:
+                    print('verify warning: {} differs from {}'.format(
+                        path, digest_dict[digest_key][0]))
+
+        ext_dict = {}
+        for key in dup_keys:
+            ext_dict[key] = [path for path in self.file_dict.pop(key) 
+                    if path in index_paths]
+        for digest_key, paths in digest_dict.items():
+            ext_paths = ext_dict[digest_key[:2]]
+            if len(paths) + len(ext_paths) > 1:
+                self.file_dict[digest_key] = sorted(paths) + ext_paths
+        verified_keys = set(digest_key[:2] for digest_key in digest_dict)
+        for key, ext_paths in ext_dict.items():
+            if len(ext_paths) > 1 and key not in verified_keys:
+                self.file_dict[key] = ext_paths
+
+    def watch(self, interval):
+        """follow changes in path and keep the rows of scan_index current
+
+        write SCAN_SUMMARY every interval seconds if a file changed, when
+        SIGUSR1 is received, and on KeyboardInterrupt. Changes made while not
+        watching are not detected, rebuild with --db to include them. Nothing
+        is watched while scan_index is empty, since the files already in the
+        tree would be missing from it.
+        """
+        def requestFlush(signum, frame):
+            flush_request.append(signum)
+
+        def flush():
+            self.file_dict = self.mergeIndexes(self.scan_index.sortedRows(
+                len(self.indexFiles()) > 0))
+            print(self.writeSummary())
+            watcher.changed = False
+            flush_request.clear()
+
+        if self.scan_index.isEmpty():
+            print('no files in {}, build with --db first'.format(
+                SCAN_DATABASE))
+            self.scan_index.close()
+            return
+        try:
+            watcher = TreeWatcher(self.path, self.scan_index, crc32
+                    , PROGRAM_FILES)
+        except OSError as E:
+            print('watch error:', E.strerror)
+            self.scan_index.close()
+            return
+        print('watching {} directories'.format(len(watcher.watches)))
+        flush_request = []
+        signal.signal(signal.SIGUSR1, requestFlush)
+        flush_time = time.monotonic() + interval
+        try:
+            while True:
+                watcher.readEvents(max(0, min(1, flush_time - time.monotonic())))
+                if flush_request or (watcher.changed 
+                        and time.monotonic() >= flush_time):
+                    flush()
+                if time.monotonic() >= flush_time:
+                    flush_time = time.monotonic() + interval
+        except KeyboardInterrupt:
+            flush()
+        except OSError as E:
+            if E.errno != errno.ENOSPC:
+                raise
+            flush()
+            print('watch error:', E.strerror)
+        finally:
+            watcher.close()
+            self.scan_index.close()
+
+    def serve(self, socket_path):
+        """load the rows of the index files and scan_index at path into a
+        LookupTable and serve it on socket_path until SIGINT or SIGTERM
+
+        the table is then saved to SERVE_SNAPSHOT, and loaded from it
+        instead of the rows while the files it was loaded from did not
+        change. Files of scan_index left without a csum by build are
+        checksummed first, those which can not be read are not served.
+        """
+        if self.scan_index is not None:
+            self.hashUnchecked()
+        chains = self.indexChains()
+        source_names = [name for index_file, delta_files in chains
+                for name in [index_file] + delta_files]
+        if self.scan_index is not None:
+            source_names.append(SCAN_DATABASE)
+        if not source_names:
+            print('no {} or {} at {} to serve'.format(SCAN_INDEX
+                , SCAN_DATABASE, self.path))
+            return
+        sources = [[name, file_stat.st_size, file_stat.st_mtime_ns]
+                for name, file_stat in ((name, os.stat(os.path.join(
+                    self.path, name))) for name in source_names)]
+        snapshot_path = os.path.join(self.path, SERVE_SNAPSHOT)
+        table = loadTable(snapshot_path, sources)
+        if table is not None:
+            print('loaded {} files from {}'.format(table.n_files
+                , SERVE_SNAPSHOT))
+        else:
+            table = LookupTable()
+            for index_file, delta_files in chains:
+                table.load(self.indexRows(index_file, delta_files))
+            if self.scan_index is not None:
+                table.load(self.scan_index.sortedRows(True))
+            print('loaded {} files from {}'.format(table.n_files
+                , ', '.join(source_names)))
+        if self.scan_index is not None:
+            self.scan_index.close()
+        try:
+            asyncio.run(serveTable(table, socket_path))
+        finally:
+            table.save(snapshot_path, sources)
+            print('wrote', SERVE_SNAPSHOT)
 
-        with open(os.path.join(self.path, summary_name), 'w', newline='') \
-                as sum_file:
-            yaml.dump(file_list, sum_file)
+    def hashUnchecked(self):
+        """checksum the files of scan_index stored without a csum and save
+        their csum to it
+
+        build leaves a file unread while no other file shares its size, but
+        a file looked up may share it. Files which can not be read keep no
+        csum, their count is printed.
+        """
+        rows = self.scan_index.uncheckedRows()
+        if not rows:
+            return
+        print('checksumming {} files without a checksum in {}'.format(
+            len(rows), SCAN_DATABASE))
+        checked_size = max_checksum_mb * 1024 * 1024
+        n_hashed = 0
+        with self.scan_index.connection:
+            for rel_path, csum in self.mapReads(crc32, [(rel_path
+                    , (os.path.join(self.path, rel_path),)
+                    , min(size, checked_size)) for rel_path, size in rows]
+                    , 'hash'):
+                self.scan_index.setCsum(rel_path, csum)
+                n_hashed += 1
+        if n_hashed < len(rows):
+            print('skipped {} files which could not be read'.format(
+                len(rows) - n_hashed))
+
+    def writeSummary(self):
+        """write file_dict to SCAN_SUMMARY, or SCAN_INDEX if building an index
+
+        without a file_dict, the MERGED_ROWS written by build are renamed.
+        """
+        summary_name = SCAN_INDEX if self.index_flag else SCAN_SUMMARY
+        with self.stats.phase('summary write') as counters:
+            if self.file_dict is None:
+                os.replace(os.path.join(self.path, MERGED_ROWS)
+                        , os.path.join(self.path, summary_name))
+            else:
+                writeRows(os.path.join(self.path, summary_name)
+                        , fileDictRows(self.file_dict, not self.index_flag))
+            counters['bytes'] += os.path.getsize(
+                    os.path.join(self.path, summary_name))
 
         return ('wrote {}'.format(summary_name))
 
@@ -278,44 +1606,6 @@ class DupSummarizer():
             for filerecord in filerecord_list:
                 writer.writerow(filerecord._asdict())
 
-    @classmethod
-    def resaveScanRecord(cls, path, subdir_file_dict):
-        '''Open SCAN_RECORD from the path and use the data while rewriting it.
-
-        For each entry in subdir_file_dict, create a FileRecord using previous
-        SCAN_RECORD data if it exists for the file.
-        '''
-        record_path = os.path.join(path, SCAN_RECORD)
-        fr_list = []
-        with open(record_path, newline='') as scanrecord_csv:
-            reader = csv.DictReader(scanrecord_csv
-                    , fieldnames=RECORD_FIELDNAMES)
-            for row in reader:
-                fr = FileRecord(row['name'], int(row['size']), int(row['csum'])
-                    , float(row['m_time']), [])
-                fr_list.append(fr)
-        for fr in fr_list:
-            if fr.size == 0:
-                continue
-            if (fr.csum, fr.size) in subdir_file_dict:
-                dup_list = subdir_file_dict[fr.csum, fr.size]
-                for dup_path in dup_list:
-                    dup_relpath = os.path.relpath(dup_path, path)
-                    fr.dups.append(dup_relpath)
-        cls.listToFile(record_path, fr_list)
-
-    @classmethod
-    def recrDupSearch(cls, path):
-        dir_list, _, _ = scanDir(path)
-        subdir_file_dict = {}
-        for dir_entry in dir_list:
-            mergeFileDict(subdir_file_dict, cls.recrDupSearch(dir_entry.path))
-        cls.resaveScanRecord(path, subdir_file_dict)
-
-        local_file_dict = loadScanRecordAsDict(path)
-        mergeFileDict(local_file_dict, subdir_file_dict)
-        return local_file_dict
-
 
 def main():
     args = docopt(__doc__)
@@ -328,84 +1618,142 @@ def main():
 
     if args['clean']:
         print('clean', path_arg)
-        removeScanFiles(path_arg)
+        removeScanFiles(TreeSnapshot(path_arg, PROGRAM_FILES
+            , stat_files=False))
+        for file_name in (SCAN_DATABASE, SNAPSHOT_FILE, CHUNK_FILE
+                , CHECKPOINT_FILE, SERVE_SNAPSHOT):
+            try:
+                os.remove(os.path.join(path_arg, file_name))
+            except FileNotFoundError:
+                print(file_name, 'not found in', path_arg)
     elif args['build'] or args['index']:
+        if args['--memory'] and (args['--snapshot'] or args['--chunks']):
+            print('--memory can not be used with --snapshot or --chunks'
+                    ', which keep every file of the tree in memory')
+            return
         if args['--full']:
-            dup_summarizer = DupSummarizer(path_arg, 'full', args['index'])
+            rescan_mode = 'full'
         elif args['--light']:
-            dup_summarizer = DupSummarizer(path_arg, 'light', args['index'])
+            rescan_mode = 'light'
         else:
-            dup_summarizer = DupSummarizer(path_arg, 'none', args['index'])
+            rescan_mode = 'none'
+        build_stats = BuildStats(args['--profile'])
+        dup_summarizer = DupSummarizer(path_arg, rescan_mode, args['index']
+                , int(args['--jobs']), args['--processes'], args['--verify']
+                , args['--compare'], args['--db'], build_stats
+                , args['--snapshot']
+                , int(args['--memory']) if args['--memory'] else None
+                , args['--disk-order'], args['--chunks'], args['--xattr']
+                , ScanScope(config_path), args['--resume'])
         dup_summarizer.build()
+        if args['--since']:
+            print(dup_summarizer.writeIndexDelta(args['--since']))
         print(dup_summarizer.writeSummary())
+        if args['--snapshot']:
+            dup_summarizer.saveSnapshot(SCAN_INDEX if args['index']
+                    else SCAN_SUMMARY)
+        if args['--stats']:
+            build_stats.writeReport(args['--stats'], path=path_arg
+                    , command='index' if args['index'] else 'build'
+                    , rescan_mode=rescan_mode, jobs=int(args['--jobs'])
+                    , read_order='disk' if args['--disk-order'] else 'path')
+            print('wrote stats to', args['--stats'])
+        else:
+            build_stats.dumpProfiles()
+    elif args['compact']:
+        DupSummarizer(path_arg, 'none', False).compactIndexes()
+    elif args['watch']:
+        if not os.path.isfile(os.path.join(path_arg, SCAN_DATABASE)):
+            print(SCAN_DATABASE, 'not found in', path_arg
+                    , 'build with --db first')
+            return
+        dup_summarizer = DupSummarizer(path_arg, 'none', False, db_flag=True)
+        dup_summarizer.watch(float(args['--interval']))
+    elif args['serve']:
+        socket_path = args['--socket'] or os.path.join(path_arg, SERVE_SOCKET)
+        DupSummarizer(path_arg, 'none', False, db_flag=os.path.isfile(
+            os.path.join(path_arg, SCAN_DATABASE))).serve(socket_path)
     elif args['dirs']:
         dup_summary = DupSummary(path_arg, config_path)
         print(dup_summary.sumSize())
         dup_summary.findDupDirs()
         dup_summary.printDupDirs()
     else:
+        action = next((command for command in ('delete', 'link', 'reflink')
+            if args[command]), None)
         print('read {} from {} and {} duplicates by {}'.format(
-            SCAN_SUMMARY, path_arg, 'delete' if args['delete'] else 'list'
-            , args['SORT']))
+            SCAN_SUMMARY, path_arg, action or 'list', args['SORT']))
         if args['--all']: print('keep all minimum files')
 
         dup_summary = DupSummary(path_arg, config_path, args['--printall']
-                , args['--all'], args['--suppress'], args['delete'])
+                , args['--all'], args['--suppress'], action
+                , int(args['--jobs']))
         print(dup_summary.sumSize())
         dup_summary.sortDups(args['SORT'])
         dup_summary.printSortResult()
+        if args['--overlap']:
+            dup_summary.printOverlaps(float(args['--overlap']) / 100)
 
 
-def removeScanFiles(path):
-    dir_list, _, _ = scanDir(path)
-    for dir_entry in dir_list:
-        removeScanFiles(dir_entry.path)
-    try:
-        os.remove(os.path.join(path, SCAN_RECORD))
-    except FileNotFoundError:
-        print(SCAN_RECORD, 'not found in', path)
-    try:
-        os.remove(os.path.join(path, PREV_SCAN_RECORD))
-    except FileNotFoundError:
-        print(PREV_SCAN_RECORD, 'not found in', path)
+def batched(iterable, n):
+    """yield lists of up to n items of iterable"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 
-def loadScanRecordAsDict(path):
-    """load a SCAN_RECORD in directory 'path' and return entries as dict
+def applyAction(action, prim_path, path):
+    """delete path or replace it with a link to prim_path
 
-    exclude all empty files. Keys in dict are tuples (file_chksum, file_size)
-    and values are singleton lists of relative paths to each file.
+    return (status, error), error is the OSError raised if any.
     """
-    record_path = os.path.join(path, SCAN_RECORD)
-    file_dict = {}
-    #empty_file_list = []
-    with open(record_path, newline='') as scanrecord_csv:
-        reader = csv.DictReader(scanrecord_csv, fieldnames=RECORD_FIELDNAMES)
-        for row in reader:
-            file_path = os.path.join(path, row['name'])
-            if row['size'] != '0':
-            #    empty_file_list.append(file_path)
-            #else:
-            #    file_dict.update({(int(row['csum']), int(row['size'])): 
-            #        [file_path]})
-                mergeFileDict(file_dict,
-                        {(int(row['csum']), int(row['size'])): [file_path]})
-    return file_dict
+    try:
+        if action == 'delete':
+            os.remove(path)
+            return 'DELETED', None
+        link_func = linkFile if action == 'link' else reflinkFile
+        if link_func(prim_path, path):
+            return 'LINKED', None
+        return 'ALREADY LINKED', None
+    except FileNotFoundError as E:
+        return 'NOT FOUND', E
+    except PermissionError as E:
+        return 'PERMISSION ERROR', E
+    except OSError as E:
+        return '{} ERROR: {}'.format('DELETE' if action == 'delete'
+                else 'LINK', E.strerror), E
 
 
-def mergeFileDict(root_dict, sub_dict):
-    """modify root_dict to add items from sub_dict. assume values are lists.
-    
-    if a key exists in both, extend value of the key in root_dict with the 
-    value in sub_dict
+def removeScanFiles(snapshot):
+    """remove the SCAN_RECORD and PREV_SCAN_RECORD of each directory of a
+    TreeSnapshot
     """
-    for key, paths in sub_dict.items():
-        if key in root_dict:
-            r_paths = root_dict[key]
-            #r_paths.extend(paths)
-            root_dict[key] = list(set(r_paths + paths))
-        else:
-            root_dict.update({key: paths})
+    for path in snapshot.dirs:
+        for record_name in (SCAN_RECORD, PREV_SCAN_RECORD):
+            try:
+                os.remove(os.path.join(path, record_name))
+            except FileNotFoundError:
+                print(record_name, 'not found in', path)
+
+
+def fileDictRows(file_dict, dups_only=False):
+    """yield a row for each path in file_dict, sorted by dupformat.rowKey
+
+    keys of file_dict are (file_chksum, file_size) tuples with an optional
+    digest. Keys of files without a checksum are skipped, if dups_only is set
+    groups of a single path are skipped as well.
+    """
+    for (csum, size, *digest), paths in sorted(
+            (item for item in file_dict.items() if item[0][0] is not None)
+            , key=lambda item: (item[0][1], item[0][0], tuple(item[0][2:]))):
+        if len(paths) > 1 or not dups_only:
+            for path in sorted(paths):
+                yield (path, size, csum, *digest)
 
 
 def loadScanRecordAsNameDict(path):
@@ -419,71 +1767,157 @@ def loadScanRecordAsNameDict(path):
     with open(record_path, newline='') as scanrecord_csv:
         reader = csv.DictReader(scanrecord_csv, fieldnames=RECORD_FIELDNAMES)
         for row in reader:
-            file_dict.update({row['name']: (int(row['size']), int(row['csum'])
-                , float(row['m_time']), row['dups'])})
+            file_dict.update({row['name']: (int(row['size'])
+                , parseInt(row['csum']), float(row['m_time']), row['dups'])})
     return file_dict
 
 
-def fileData(dir_entry):
-    """return a FileRecord of the corresponding directory entry
+def loadScanRecord(path):
+    """load a SCAN_RECORD in directory 'path' and return a list of FileRecords
 
-    Assume dir_entry points to a file. Populate 'dups' field w/ empty list
+    dups field of each record is an empty list. inode and dev fields are
+    None for records written by earlier versions.
     """
-    file_stat = dir_entry.stat()
-    #print('scanning {} at {}. size: {}'.format(dir_entry.name, dir_entry.path,
-    #    file_stat.st_size))
-    return FileRecord(name=dir_entry.name, size=file_stat.st_size
-            , csum=crc32(dir_entry.path)
-            , m_time=file_stat.st_mtime, dups=[])
+    record_path = os.path.join(path, SCAN_RECORD)
+    fr_list = []
+    with open(record_path, newline='') as scanrecord_csv:
+        reader = csv.DictReader(scanrecord_csv, fieldnames=RECORD_FIELDNAMES)
+        for row in reader:
+            fr_list.append(FileRecord(row['name'], int(row['size'])
+                , parseInt(row['csum']), float(row['m_time']), []
+                , parseInt(row['inode']), parseInt(row['dev'])))
+    return fr_list
+
+
+def loadTree(snapshot):
+    """return a dict of the SCAN_RECORDs of each directory of a TreeSnapshot
+
+    values in dict are tuples (files, subdirs): a list of (name, size, csum)
+    for each file in the directory, and a list of the paths of its
+    subdirectories. A directory without a SCAN_RECORD is listed with a single
+    file without a csum.
+    """
+    tree = {}
+    for dir_path, listing in snapshot.dirs.items():
+        if SCAN_RECORD in listing.program_files:
+            files = [(fr.name, fr.size, fr.csum) 
+                    for fr in loadScanRecord(dir_path)]
+        else:
+            print(SCAN_RECORD, 'not found in', dir_path)
+            files = [(SCAN_RECORD, 0, None)]
+        subdirs = [os.path.join(dir_path, name) for name in listing.subdirs
+                if os.path.join(dir_path, name) in snapshot.dirs]
+        tree[dir_path] = (files, subdirs)
+    return tree
+
+
+def parseInt(field):
+    """return a field of a SCAN_RECORD row as an int or None if empty"""
+    return int(field) if field not in ('', None) else None
+
+
+def linkKey(row):
+    """return a key shared by the link rows of externalScan of hard links to
+    one inode, like inodeKey
+    """
+    return tuple(row[:4]) if row[1] == 0 else tuple(row[:6])
+
+
+def pathDups(path_list):
+    """yield (dir_path, i, dups) for each (path, dir_path, i) of a bucket
+
+    dups lists the paths, relative to dir_path, of the files of the bucket in
+    a subdirectory of dir_path. They are found in the bucket sorted by path,
+    by a binary search for the directory prefix.
+    """
+    next_sep = chr(ord(os.sep) + 1)
+    path_list = sorted(path_list)
+    for _, dir_path, i in path_list:
+        prefix = os.path.join(dir_path, '')
+        lo = bisect_left(path_list, (prefix,))
+        hi = bisect_left(path_list, (prefix[:-1] + next_sep,))
+        yield dir_path, i, [path[len(prefix):] for path, dup_dir, _
+                in path_list[lo:hi] if dup_dir != dir_path]
+
+
+def inodeKey(path, i, fr):
+    """return a key shared by the FileRecords of hard links to one inode
+
+    records without an inode, i in directory path, get a key of their own.
+    """
+    if fr.inode is None:
+        return (path, i)
+    return (fr.dev, fr.inode)
+
+
+def fileData(name, file_stat, scan_index=None, reuse=True, file_path=None):
+    """return a FileRecord of the file name with stat result file_stat
+
+    Populate 'dups' field w/ empty list. The file is not read: 'csum' is None
+    unless the file is empty, or unless scan_index has a checksum for its
+    inode and reuse is set, or unless file_path is given and the checksum
+    cached in its xattr matches file_stat.
+    """
+    csum = 0 if file_stat.st_size == 0 else None
+    if scan_index is not None:
+        stored_csum = scan_index.storedCsum(file_stat, reuse)
+        if csum is None:
+            csum = stored_csum
+    if csum is None and file_path is not None:
+        csum = readCsum(file_path, file_stat, csumAlgorithm())
+    return FileRecord(name=name, size=file_stat.st_size
+            , csum=csum, m_time=file_stat.st_mtime, dups=[]
+            , inode=file_stat.st_ino, dev=file_stat.st_dev)
+
+
+def csumAlgorithm():
+    """return the name of the checksum computed by crc32, cached in xattrs"""
+    return 'crc32-{}m'.format(max_checksum_mb)
 
 
-def crc32(filename):
+def crc32(filename, advise=False):
     """open specified file and calculate crc32, return as hex string
 
     copied from CrouZ's answer: 
     stackoverflow.com/questions/1742866/compute-crc-of-file-in-python
+    if advise is set, the file is read with posix_fadvise hints.
     """
     max_chunks = max_checksum_mb * 16
-    fh = open(filename, 'rb')
-    result = 0
-    for i in range(max_chunks):
-        #read in 64 kb chunks
-        try:
+    with open(filename, 'rb') as fh:
+        if advise:
+            adviseSequential(fh)
+        result = 0
+        for i in range(max_chunks):
+            #read in 64 kb chunks
             s = fh.read(65536)
-        except OSError as E:
-            print(filename)
-            print(E)
-            sys.exit()
-        if not s:
-            break
-        result = zlib.crc32(s, result)
-    fh.close()
+            if not s:
+                break
+            result = zlib.crc32(s, result)
+        if advise:
+            adviseDone(fh)
     #print(hex(result))
     #return "%08X" % (result & 0xFFFFFFFF)
     return result
 
 
-def scanDir(root):
-    """return a 3-tuple of directories, files, and symlinks in dir_path
+def sampleCrc32(filename, size, advise=False):
+    """return a crc32 of the head and tail of the bytes checked by crc32()
 
-    each item is a list of dirEntry objects as returned by os.scanDir()
-    entries with name matching SCAN_RECORD are not included in file list
-    entries in directories and files are not symbolic links. 
-    entries in symlinks may link to either directories or files
+    reads at most sample_checksum_kb from each end of the leading
+    max_checksum_mb of the file. Files with different samples can not have
+    the same crc32() result. If advise is set, the pages read are dropped
+    from the page cache.
     """
-    dir_list = os.scandir(root)
-    directories = []
-    files = []
-    symlinks = []
-    for entry in dir_list:
-        if entry.is_dir(follow_symlinks=False):
-            directories.append(entry)
-        elif entry.is_file(follow_symlinks=False):
-            if not (entry.name in PROGRAM_FILES):
-                files.append(entry)
-        elif entry.is_symlink():
-            symlinks.append(entry)
-    return (directories, files, symlinks)
+    sample_size = sample_checksum_kb * 1024
+    checked_size = min(size, max_checksum_mb * 1024 * 1024)
+    with open(filename, 'rb') as fh:
+        result = zlib.crc32(fh.read(sample_size))
+        if checked_size > sample_size:
+            fh.seek(max(sample_size, checked_size - sample_size))
+            result = zlib.crc32(fh.read(checked_size - fh.tell()), result)
+        if advise:
+            adviseDone(fh)
+    return result
 
 
 if __name__ == '__main__':
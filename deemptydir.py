@@ -1,6 +1,22 @@
-import deduplicate
+"""Find and delete directories holding no files.
+
+The tree is walked once, bottom-up, on directory file descriptors: each
+directory is opened relative to its parent without following symbolic links,
+and is known to be empty once all of its subdirectories are. Empty
+directories are deleted in the same pass with rmdir, which fails rather than
+remove a file created meanwhile. Symbolic links and the files written by
+deduplicate.py do not count as files, and are removed with the directory
+holding them. With --db, directories are found from the .deduplicator_db of
+a build --db instead of listing them, unless that build had [scan] rules.
+"""
+import os
+import errno
 import argparse
-import shutil
+from dupindex import ScanIndex, SCAN_DATABASE
+from dupfiles import PROGRAM_FILES
+
+DIR_FLAGS = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW
+
 
 def main():
     parser = argparse.ArgumentParser(description=
@@ -8,50 +24,164 @@ def main():
     parser.add_argument('path', help='Path to search after')
     parser.add_argument('-d', action='store_true', help=
             'Delete all empty directories')
+    parser.add_argument('--db', action='store_true', help=
+            'Find empty directories from the {} of a build --db'.format(
+                SCAN_DATABASE))
     args = parser.parse_args()
     delete_flag = args.d
-    emptydirs = emptyDirSearch(args.path)
-    print('Empty Directories', *emptydirs, sep='\n-\t')
-    if delete_flag:
-        deleteDirs(emptydirs)
-
-def deleteDirs(dir_list):
-    def deletePath(path_arg):
-        dirs, files, symlinks = deduplicate.scanDir(path_arg)
-        #print('[F:{}]\t[D:{}]\tat path {}'.format(len(files), len(dirs)
-        #    , path_arg))
-        if len(files) != 0:
-            return False
-        for entry in symlinks:
-            print('symlink:', entry.name)
-        if all([deletePath(entry.path) for entry in dirs]):
-            print('deleting', path_arg) 
-            shutil.rmtree(path_arg)
-            return True
-        else: return False
-    for dir_path in dir_list:
-        if not deletePath(dir_path):
-            print('COULD NOT DELETE:', dir_path)
+    emptydirs = None
+    if args.db:
+        emptydirs = indexEmptyDirs(args.path, delete_flag)
+    if emptydirs is None:
+        emptydirs = emptyDirSearch(args.path, delete_flag)
+    print('Deleted Directories' if delete_flag else 'Empty Directories'
+            , *emptydirs, sep='\n-\t')
+
 
-    
+def emptyDirSearch(path_arg, delete=False):
+    """return a list of the topmost directories under path_arg holding no files
 
-def emptyDirSearch(path_arg):
-    dirs, files, symlinks = deduplicate.scanDir(path_arg)
+    path_arg itself is listed if it holds no files. If delete is set, each
+    directory listed is deleted.
+    """
     empty_dirs = []
+    top_fd = os.open(path_arg, DIR_FLAGS)
+    try:
+        current_empty = searchDirFd(top_fd, path_arg, empty_dirs, delete)
+    finally:
+        os.close(top_fd)
+    if current_empty:
+        if delete and not removeDir(path_arg):
+            return []
+        return [path_arg]
+    return empty_dirs
+
+
+def searchDirFd(dir_fd, dir_path, empty_dirs, delete):
+    """return True if the directory open at dir_fd holds no files
+
+    its empty subdirectories are deleted if delete is set, and added to
+    empty_dirs unless it holds no files either.
+    """
+    empty_subdirs = []
+    removable = []
     current_empty = True
-    #print('[F:{}]\t[D:{}]\tat path {}'.format(len(files), len(dirs)
-    #    , path_arg))
-    for entry in symlinks:
-        print('symlink:', entry.name)
-    for entry in dirs:
-        result_list = emptyDirSearch(entry.path)
-        if entry.path not in result_list:
+    with os.scandir(dir_fd) as entries:
+        entries = list(entries)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            try:
+                sub_fd = os.open(entry.name, DIR_FLAGS, dir_fd=dir_fd)
+            except (FileNotFoundError, NotADirectoryError):
+                current_empty = False
+                continue
+            try:
+                if searchDirFd(sub_fd, os.path.join(dir_path, entry.name)
+                        , empty_dirs, delete):
+                    empty_subdirs.append(entry.name)
+                else:
+                    current_empty = False
+            finally:
+                os.close(sub_fd)
+        elif entry.is_symlink():
+            print('symlink:', entry.name)
+            removable.append(entry.name)
+        elif entry.name in PROGRAM_FILES:
+            removable.append(entry.name)
+        else:
+            current_empty = False
+
+    deleted = []
+    for name in empty_subdirs:
+        if not delete or removeDir(os.path.join(dir_path, name), dir_fd
+                , name):
+            deleted.append(name)
+        else:
             current_empty = False
-        empty_dirs.extend(result_list)
-    if len(files) != 0:
-        current_empty = False
-    if current_empty: return [path_arg]
-    else: return empty_dirs
+    if delete and current_empty:
+        for name in removable:
+            try:
+                os.unlink(name, dir_fd=dir_fd)
+            except FileNotFoundError:
+                pass
+    if not current_empty:
+        empty_dirs.extend(os.path.join(dir_path, name) for name in deleted)
+    return current_empty
+
+
+def removeDir(path, dir_fd=None, name=None):
+    """rmdir the empty directory name in dir_fd, or path
+
+    return False if it could not be deleted, e.g. a file was created in it.
+    """
+    try:
+        if dir_fd is None:
+            os.rmdir(path)
+        else:
+            os.rmdir(name, dir_fd=dir_fd)
+    except OSError as E:
+        if E.errno == errno.ENOENT:
+            return True
+        print('COULD NOT DELETE:', path, '({})'.format(E.strerror))
+        return False
+    return True
+
+
+def indexEmptyDirs(path_arg, delete=False):
+    """return a list of the topmost directories under path_arg holding no files
+    according to its SCAN_DATABASE
+
+    return None if there is no SCAN_DATABASE with directory rows, or if its
+    build left files out by [scan] rules, so a directory holding only such
+    files is not taken for empty. If delete
+    is set, the directories of each subtree listed are deleted bottom-up with
+    rmdir, so a directory holding files not in the database is kept.
+    """
+    if not os.path.isfile(os.path.join(path_arg, SCAN_DATABASE)):
+        print(SCAN_DATABASE, 'not found in', path_arg)
+        return None
+    scan_index = ScanIndex(path_arg)
+    try:
+        dir_paths = scan_index.dirPaths()
+        file_paths = scan_index.filePaths()
+        scoped = scan_index.isScoped()
+    finally:
+        scan_index.close()
+    if not dir_paths and not file_paths:
+        print('no directories in', SCAN_DATABASE, 'rebuild with --db')
+        return None
+    if scoped:
+        print(SCAN_DATABASE, 'was built with [scan] rules and does not list'
+                ' every file, listing directories instead')
+        return None
+
+    full_dirs = set()
+    for file_path in file_paths:
+        rel_dir = os.path.dirname(file_path)
+        while rel_dir and rel_dir not in full_dirs:
+            full_dirs.add(rel_dir)
+            rel_dir = os.path.dirname(rel_dir)
+    if not file_paths:
+        top_dirs = ['']
+    else:
+        top_dirs = sorted(rel_dir for rel_dir in dir_paths
+                if rel_dir not in full_dirs and (os.path.dirname(rel_dir)
+                    in full_dirs or not os.path.dirname(rel_dir)))
+
+    empty_dirs = []
+    for top_dir in top_dirs:
+        path = os.path.join(path_arg, top_dir) if top_dir else path_arg
+        if delete:
+            prefix = os.path.join(top_dir, '') if top_dir else ''
+            subtree = [rel_dir for rel_dir in dir_paths
+                    if rel_dir.startswith(prefix)] + [top_dir]
+            if not all([removeDir(os.path.join(path_arg, rel_dir)
+                    if rel_dir else path_arg) for rel_dir
+                    in sorted(subtree, key=len, reverse=True)]):
+                continue
+        empty_dirs.append(path)
+    return empty_dirs
+
 
 if __name__ == '__main__':
     main()
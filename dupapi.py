@@ -0,0 +1,93 @@
+"""Find duplicate files and act on them from Python.
+
+The commands of deduplicate.py write a deduplicator_summary and read it back.
+Here the groups of duplicates come straight from the scan of build, one at a
+time, and are sorted and deleted or linked as they are consumed, so a caller
+can act on each group without a summary file. The tree is still listed and
+checksummed in full before the first group, since a group is only known once
+every file of its size is checksummed. Messages printed by the scan are
+suppressed unless verbose is set.
+
+    for group in duplicateGroups('/data', jobs=4):
+        for prim_paths, path, status, error in applyActions(
+                rankGroups([group], 'depth', '/data'), 'link'):
+            ...
+"""
+import io
+import os
+import sys
+from collections import namedtuple
+from contextlib import redirect_stdout
+
+from deduplicate import (DupSummarizer, DupSummary, applyAction, batched
+        , CONFIG_FILE, action_batch_size)
+from dupstats import BuildStats
+from duphash import HashExecutor
+
+DupGroup = namedtuple('DupGroup', ['size', 'csum', 'paths'])
+RankedGroup = namedtuple('RankedGroup'
+        , ['size', 'csum', 'prim_paths', 'paths'])
+
+
+def duplicateGroups(path, rescan_mode='none', jobs=1, processes=False
+        , db=False, stats=None, verbose=False):
+    """yield a DupGroup for each group of duplicate files under path, in
+    order of size
+
+    path is scanned as by deduplicate.py build, with the same rescan_mode
+    ('none', 'light' or 'full'), jobs, processes and db options, and its scan
+    records are saved. stats may be a dupstats.BuildStats to time the scan.
+    Files listed in the deduplicator_index files at path are merged into the
+    groups, their paths are prefixed by the name of their index file.
+    """
+    if stats is None:
+        stats = BuildStats(progress=verbose)
+    summarizer = DupSummarizer(path, rescan_mode, False, jobs, processes
+            , db_flag=db, stats=stats)
+    with redirect_stdout(sys.stdout if verbose else io.StringIO()):
+        groups = summarizer.dupGroups()
+    for csum, size, paths in groups:
+        yield DupGroup(size, csum, paths)
+
+
+def rankGroups(groups, sort_func_name, path, cfg_path=None
+        , include_all=False, jobs=1):
+    """yield a RankedGroup for each DupGroup of groups, sorting its paths
+    into primary and duplicate paths like deduplicate.py list
+
+    sort_func_name is one of the SORT keys of deduplicate.py. cfg_path is the
+    deduplicate.ini used by dlist and plist, by default the one at path or
+    else the one next to deduplicate.py. Groups are consumed lazily,
+    action_batch_size at a time, with the sort keys computed by jobs
+    threads.
+    """
+    if cfg_path is None:
+        cfg_path = os.path.join(path, CONFIG_FILE)
+        if not os.path.isfile(cfg_path):
+            cfg_path = os.path.join(os.path.dirname(os.path.abspath(
+                __file__)), CONFIG_FILE)
+    dup_summary = DupSummary(path, cfg_path, a_flag=include_all, jobs=jobs
+            , groups=((group.csum, group.size, group.paths)
+                for group in groups))
+    dup_summary.sortDups(sort_func_name)
+    for prim_paths, paths, csum, size in dup_summary.filter_result:
+        yield RankedGroup(size, csum, prim_paths, paths)
+
+
+def applyActions(ranked_groups, action, jobs=1):
+    """delete each duplicate path of ranked_groups, or replace it with a
+    'link' or 'reflink' to the first primary path
+
+    yield (prim_paths, path, status, error) for each duplicate path, with
+    status and error as returned by deduplicate.applyAction: error is the
+    OSError raised, if any. The action runs on jobs threads for
+    action_batch_size groups at a time. No deduplicator_journal is kept.
+    """
+    executor = HashExecutor(jobs)
+    for group_batch in batched(ranked_groups, action_batch_size):
+        results = dict(executor.map(applyAction
+            , [(path, (action, group.prim_paths[0], path), 0)
+                for group in group_batch for path in group.paths]))
+        for group in group_batch:
+            for path in group.paths:
+                yield (group.prim_paths, path) + results[path]
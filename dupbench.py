@@ -0,0 +1,273 @@
+"""Generate synthetic trees and time deduplicate.py on them.
+
+Usage:
+    dupbench.py DIR generate [options]
+    dupbench.py DIR run [--output FILE] [--label LABEL] [--jobs N] [options]
+    dupbench.py DIR step STEP [--jobs N]
+
+Commands:
+    generate    Write a synthetic tree at DIR
+    run         Generate a tree at DIR if it does not exist, time each step
+            on it and append the results to the output file
+    step        Time a single step in the current process and print its
+            results as JSON (used by run)
+
+Options:
+    DIR     The directory of the synthetic tree.
+    --files N   Number of files. [default: 1000]
+    --depth D   Number of nested directory levels. [default: 3]
+    --fanout F  Number of subdirectories in each directory. [default: 4]
+    --max-size KB   Largest file size, sizes are log-uniform from 1 byte.
+            [default: 1024]
+    --dup-ratio R   Fraction of files copied from another file.
+            [default: 0.2]
+    --link-ratio R  Fraction of files hard linked to another file.
+            [default: 0.05]
+    --mirror-ratio R    Fraction of leaf directories copied to a mirror
+            directory. [default: 0.05]
+    --seed S    Seed of the random generator. [default: 0]
+    -o FILE, --output FILE  File to append results to, one JSON object
+            per run. [default: dupbench_results.jsonl]
+    --label LABEL   Label stored with the results. [default: ]
+    -j N, --jobs N  Passed to the build, index, list and delete steps.
+            [default: 1]
+
+Steps (run in this order, the tree is not modified):
+    build       build on a tree without scan records
+    build-none  build reusing the scan records
+    build-light build --light
+    build-full  build --full
+    index       index
+    list        list depth
+    delete      list date, the sort and selection of a delete by date
+            without removing any file
+    dirs        dirs
+    deemptydir  deemptydir.emptyDirSearch
+    clean       clean
+
+Each step runs in a child process and records its wall time, peak RSS, bytes
+read and read/write syscalls (from /proc/self/io, Linux only).
+"""
+
+import os
+import sys
+import io
+import json
+import random
+import shutil
+import subprocess
+import resource
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+from docopt import docopt
+import deduplicate
+import deemptydir
+
+STEPS = ['build', 'build-none', 'build-light', 'build-full', 'index', 'list'
+        , 'delete', 'dirs', 'deemptydir', 'clean']
+STEP_ARGS = {
+        'build': ['build'],
+        'build-none': ['build'],
+        'build-light': ['build', '--light'],
+        'build-full': ['build', '--full'],
+        'index': ['index'],
+        'list': ['list', 'depth'],
+        'delete': ['list', 'date'],
+        'dirs': ['dirs'],
+        'clean': ['clean']}
+JOBS_STEPS = ['build', 'build-none', 'build-light', 'build-full', 'index'
+        , 'list', 'delete']
+GENERATOR_OPTIONS = ['--files', '--depth', '--fanout', '--max-size'
+        , '--dup-ratio', '--link-ratio', '--mirror-ratio', '--seed']
+
+
+def main():
+    args = docopt(__doc__)
+    tree_path = args['DIR']
+    if args['generate']:
+        print(generateTree(tree_path, **generatorParams(args)))
+    elif args['step']:
+        print(json.dumps(runStep(tree_path, args['STEP']
+            , int(args['--jobs']))))
+    else:
+        params = generatorParams(args)
+        if not os.path.isdir(tree_path):
+            print(generateTree(tree_path, **params))
+        result = {
+                'label': args['--label'],
+                'commit': gitCommit(),
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'jobs': int(args['--jobs']),
+                'params': params,
+                'tree': treeStats(tree_path),
+                'steps': {}}
+        for file_name in (deduplicate.SCAN_SUMMARY, deduplicate.SCAN_INDEX):
+            if os.path.isfile(os.path.join(tree_path, file_name)):
+                os.remove(os.path.join(tree_path, file_name))
+        for step in STEPS:
+            result['steps'][step] = timeStep(tree_path, step, args['--jobs'])
+            print('{:<12}{wall:>10.3f} s{max_rss_kb:>10} KiB{rchar:>14} B read'
+                .format(step, **result['steps'][step]))
+        with open(args['--output'], 'a') as output_file:
+            output_file.write(json.dumps(result) + '\n')
+        print('results appended to', args['--output'])
+
+
+def generatorParams(args):
+    """return the generateTree keyword arguments from docopt args"""
+    params = {}
+    for option in GENERATOR_OPTIONS:
+        value = args[option]
+        params[option[2:].replace('-', '_')] = float(value) \
+                if 'ratio' in option else int(value)
+    return params
+
+
+def generateTree(tree_path, files, depth, fanout, max_size, dup_ratio
+        , link_ratio, mirror_ratio, seed):
+    """write a synthetic tree of directories and files at tree_path
+
+    directories are nested depth levels with fanout subdirectories each,
+    named like the directories of demo_fs. Files are spread over all
+    directories at random. A file is a copy of an earlier file with
+    probability dup_ratio, a hard link to one with probability link_ratio,
+    and has unique contents otherwise. Some leaf directories are then copied
+    whole to a sibling mirror directory. The same arguments always write the
+    same tree.
+    """
+    rand = random.Random(seed)
+    dir_paths = [tree_path]
+    level = [tree_path]
+    for _ in range(depth):
+        next_level = []
+        for dir_path in level:
+            prefix = os.path.basename(dir_path)[-1:].upper() \
+                    if dir_path != tree_path else ''
+            for i in range(fanout):
+                next_level.append(os.path.join(dir_path
+                    , '{}directory{}'.format(prefix, dirName(i))))
+        dir_paths.extend(next_level)
+        level = next_level
+    for dir_path in dir_paths:
+        os.makedirs(dir_path, exist_ok=True)
+
+    file_paths = []
+    n_bytes = 0
+    for i in range(files):
+        dir_path = rand.choice(dir_paths)
+        file_path = os.path.join(dir_path, 'file{}'.format(i))
+        choice = rand.random()
+        if file_paths and choice < link_ratio:
+            os.link(rand.choice(file_paths), file_path)
+        elif file_paths and choice < link_ratio + dup_ratio:
+            shutil.copyfile(rand.choice(file_paths), file_path)
+            n_bytes += os.path.getsize(file_path)
+        else:
+            size = int(2 ** rand.uniform(0, (max_size * 1024).bit_length()))
+            size = min(size, max_size * 1024)
+            with open(file_path, 'wb') as fh:
+                fh.write(fileContents(seed, i, size))
+            n_bytes += size
+        file_paths.append(file_path)
+
+    leaf_dirs = level if depth > 0 else []
+    n_mirrors = 0
+    for dir_path in rand.sample(leaf_dirs
+            , int(len(leaf_dirs) * mirror_ratio)):
+        shutil.copytree(dir_path, dir_path + '_mirror')
+        n_mirrors += 1
+    return 'generated {} files ({} bytes) in {} directories, {} mirrored' \
+            ' at {}'.format(files, n_bytes, len(dir_paths), n_mirrors
+                    , tree_path)
+
+
+def dirName(i):
+    """return the letters naming the i-th directory: A, B, ..., Z, AA, ..."""
+    name = ''
+    i += 1
+    while i > 0:
+        i, rem = divmod(i - 1, 26)
+        name = chr(ord('A') + rem) + name
+    return name
+
+
+def fileContents(seed, i, size):
+    """return size bytes unique to file i, differing at the start and end"""
+    line = '{}:{}\n'.format(seed, i).encode()
+    contents = line * (size // len(line) + 1)
+    return contents[:size - len(line)] + line if size > len(line) \
+            else contents[:size]
+
+
+def treeStats(tree_path):
+    """return the number of files, directories and bytes under tree_path"""
+    stats = {'files': 0, 'dirs': 0, 'bytes': 0}
+    for dir_path, _, file_names in os.walk(tree_path):
+        stats['dirs'] += 1
+        for name in file_names:
+            if name in deduplicate.PROGRAM_FILES:
+                continue
+            stats['files'] += 1
+            stats['bytes'] += os.lstat(os.path.join(dir_path, name)).st_size
+    return stats
+
+
+def gitCommit():
+    """return the commit hash of the deduplicator checkout, if any"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD']
+                , cwd=os.path.dirname(os.path.abspath(__file__))
+                , capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def timeStep(tree_path, step, jobs):
+    """run step in a child process and return its results"""
+    output = subprocess.run([sys.executable, os.path.abspath(__file__)
+        , tree_path, 'step', step, '--jobs', str(jobs)]
+        , capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def runStep(tree_path, step, jobs):
+    """run step in this process and return its results
+
+    the output of the step is discarded.
+    """
+    io_before = procIo()
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        if step == 'deemptydir':
+            deemptydir.emptyDirSearch(tree_path)
+        else:
+            step_args = STEP_ARGS[step]
+            if step in JOBS_STEPS:
+                step_args = step_args + ['--jobs', str(jobs)]
+            sys.argv = [deduplicate.__file__, tree_path, *step_args]
+            deduplicate.main()
+    wall = time.perf_counter() - start
+    io_after = procIo()
+    result = {'wall': wall
+            , 'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    for field in ('rchar', 'read_bytes', 'syscr', 'syscw'):
+        if field in io_after:
+            result[field] = io_after[field] - io_before[field]
+        else:
+            result[field] = None
+    return result
+
+
+def procIo():
+    """return the counters of /proc/self/io, or an empty dict"""
+    try:
+        with open('/proc/self/io') as io_file:
+            return {name: int(value) for name, value in
+                    (line.split(':') for line in io_file)}
+    except OSError:
+        return {}
+
+
+if __name__ == '__main__':
+    main()
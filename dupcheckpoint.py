@@ -0,0 +1,84 @@
+"""Keep the checksums computed by a build, so an interrupted build resumes.
+
+Scan records are only written once every file is checksummed. Meanwhile each
+checksum is appended to CHECKPOINT_FILE at the scan root, with the size and
+mtime of the file, and the file is flushed every checkpoint_interval seconds
+and when the build stops, including on an error or interrupt. build --resume
+reads it back and does not read again a file whose size and mtime still
+match. The header holds the checksum algorithm, so checksums of another
+algorithm are not reused. A build which completes removes the file.
+"""
+import os
+import json
+import time
+
+CHECKPOINT_FILE = '.deduplicator_checkpoint'
+CHECKPOINT_HEADER = '#deduplicator-checkpoint'
+CHECKPOINT_VERSION = 1
+checkpoint_interval = 30
+
+
+class HashCheckpoint():
+    """the checksums recorded at root, keyed by relative path
+
+    resumed is set if resume is set and CHECKPOINT_FILE was written by an
+    earlier run, or else CHECKPOINT_FILE is started again. saved then holds
+    (size, m_time, csum) of each file recorded, unless load is False and
+    they are only read by savedRows.
+    """
+    def __init__(self, root, algorithm, resume=False, load=True):
+        self.root = root
+        self.checkpoint_path = os.path.join(root, CHECKPOINT_FILE)
+        header = '{} {} {}\n'.format(CHECKPOINT_HEADER, CHECKPOINT_VERSION
+                , algorithm)
+        self.saved = {}
+        self.resumed = False
+        if resume and os.path.isfile(self.checkpoint_path):
+            with open(self.checkpoint_path, newline='') as checkpoint_file:
+                if checkpoint_file.readline() != header:
+                    print('checkpoint warning: {} is from another version'
+                            ', not resumed'.format(CHECKPOINT_FILE))
+                else:
+                    self.resumed = True
+        if self.resumed and load:
+            for rel_path, size, m_time, csum in self.savedRows():
+                self.saved[rel_path] = (size, m_time, csum)
+        self.checkpoint_file = open(self.checkpoint_path
+                , 'a' if self.resumed else 'w', newline='')
+        if not self.resumed:
+            self.checkpoint_file.write(header)
+        self.flush_time = time.monotonic()
+
+    def savedRows(self):
+        """yield (rel_path, size, m_time, csum) of each checksum recorded by
+        the earlier run, in the order recorded
+        """
+        with open(self.checkpoint_path, newline='') as checkpoint_file:
+            checkpoint_file.readline()
+            for line in checkpoint_file:
+                try:
+                    rel_path, size, m_time, csum = json.loads(line)
+                except ValueError:
+                    break
+                yield rel_path, size, m_time, csum
+
+    def csum(self, rel_path, size, m_time):
+        """return the saved csum of rel_path if its size and m_time match"""
+        saved = self.saved.get(rel_path)
+        if saved is not None and saved[0] == size and saved[1] == m_time:
+            return saved[2]
+        return None
+
+    def record(self, rel_path, size, m_time, csum):
+        self.checkpoint_file.write(json.dumps([rel_path, size, m_time, csum]
+            , separators=(',', ':')) + '\n')
+        if time.monotonic() - self.flush_time >= checkpoint_interval:
+            self.checkpoint_file.flush()
+            self.flush_time = time.monotonic()
+
+    def close(self):
+        self.checkpoint_file.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.checkpoint_path)
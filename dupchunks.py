@@ -0,0 +1,204 @@
+"""Split large files into content-defined chunks and keep their chunk lists.
+
+Chunk boundaries depend only on the last cut_bits bytes read: each byte is
+mapped to one bit by a fixed random table, and a chunk ends after the first
+run of cut_bits one bits, so bytes changed in one place of a file change
+only the chunks around them. The bits of each block read are computed at
+once with bytes.translate and runs are found with bytes.find, so chunking
+runs in C rather than a loop per byte. The chunk list of each file (length
+and BLAKE2b digest of each chunk) is kept in CHUNK_FILE at the scan root. A
+file whose size and mtime did not change keeps its list, and is not read.
+A changed file is read and digested in full: its stored chunks are compared
+with the bytes read, and only the runs of chunks which no longer match are
+searched for boundaries again, until a new boundary meets an old one. This
+keeps the unchanged chunks of a file at the same boundaries, it does not
+save any read.
+Files sharing chunks without being duplicates, e.g. disk images of one
+machine, are found by comparing their chunk lists.
+"""
+import os
+import json
+import hashlib
+from collections import defaultdict
+
+CHUNK_FILE = '.deduplicator_chunks'
+CHUNK_HEADER = '#deduplicator-chunks'
+CHUNK_VERSION = 2
+min_file_mb = 64
+min_chunk_kb = 16
+max_chunk_kb = 256
+cut_bits = 16
+max_chunk_files = 64
+read_size_kb = 1024
+BIT_TABLE = bytes(hashlib.blake2b(bytes([i]), digest_size=1).digest()[0] & 1
+    for i in range(256))
+CUT_RUN = b'\x01' * cut_bits
+
+
+def chunkDigest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def cutPoint(bits, start, length):
+    """return the length of the chunk starting at start, of at most length
+    bytes, given the BIT_TABLE bits of its bytes
+
+    the first min_chunk_kb of a chunk are skipped, and a chunk ends after at
+    most max_chunk_kb or at the end of the bytes.
+    """
+    limit = min(length, max_chunk_kb * 1024)
+    run_start = bits.find(CUT_RUN, start + max(0, min_chunk_kb * 1024
+        - cut_bits + 1), start + limit)
+    if run_start < 0:
+        return limit
+    return run_start + cut_bits - start
+
+
+class ChunkReader():
+    """read a file forward, keeping the bytes not yet chunked and their
+    BIT_TABLE bits in a buffer from position pos
+    """
+    def __init__(self, fh):
+        self.fh = fh
+        self.buffer = b''
+        self.bits = b''
+        self.pos = 0
+        self.offset = 0
+        self.eof = False
+        self.n_read = 0
+
+    def peek(self, n_bytes):
+        """return a memoryview of the next n_bytes, or fewer at the end of
+        the file, without moving past them
+        """
+        while len(self.buffer) - self.pos < n_bytes and not self.eof:
+            data = self.fh.read(max(read_size_kb * 1024
+                , n_bytes - len(self.buffer) + self.pos))
+            self.n_read += len(data)
+            self.eof = not data
+            self.buffer = self.buffer[self.pos:] + data
+            self.bits = self.bits[self.pos:] + data.translate(BIT_TABLE)
+            self.pos = 0
+        return memoryview(self.buffer)[self.pos:self.pos + n_bytes]
+
+    def skip(self, n_bytes):
+        self.pos += n_bytes
+        self.offset += n_bytes
+
+    def nextChunk(self):
+        """return the next content-defined chunk, empty at the end of file"""
+        data = self.peek(max_chunk_kb * 1024)
+        data = data[:cutPoint(self.bits, self.pos, len(data))]
+        self.skip(len(data))
+        return data
+
+
+def fileChunks(filename, size, m_time, saved=None):
+    """return (size, m_time, chunks, n_read, n_reused) for a file
+
+    chunks is a list of [length, digest]. saved is the (size, m_time, chunks)
+    stored for the file, its chunks are reused unchanged if the size and
+    m_time match, without reading the file. Otherwise the whole file is read,
+    and the saved chunks are reused where the digest of their bytes still
+    matches. Chunking starts again at the first chunk which does not, and
+    old chunks are compared again from the first new boundary found at the
+    end of an old chunk. n_read is the number of bytes read and n_reused the
+    number of chunks reused.
+    """
+    if saved is not None and saved[0] == size and saved[1] == m_time:
+        return (size, m_time, saved[2], 0, len(saved[2]))
+    old_chunks = saved[2] if saved is not None else []
+    old_ends = {}
+    offset = 0
+    for i, (length, _) in enumerate(old_chunks):
+        offset += length
+        old_ends[offset] = i + 1
+
+    chunks = []
+    n_reused = 0
+    with open(filename, 'rb') as fh:
+        reader = ChunkReader(fh)
+        i = 0
+        while True:
+            if i is not None and i < len(old_chunks):
+                length, digest = old_chunks[i]
+                data = reader.peek(length)
+                if len(data) == length and chunkDigest(data) == digest:
+                    reader.skip(length)
+                    chunks.append([length, digest])
+                    n_reused += 1
+                    i += 1
+                    continue
+            data = reader.nextChunk()
+            if not data:
+                break
+            chunks.append([len(data), chunkDigest(data)])
+            i = old_ends.get(reader.offset)
+    return (size, m_time, chunks, reader.n_read, n_reused)
+
+
+class ChunkIndex():
+    """the chunk lists of the files under root, keyed by relative path
+
+    values are (size, m_time, chunks) as returned by fileChunks.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.files = {}
+        try:
+            with open(os.path.join(root, CHUNK_FILE), newline='') \
+                    as chunk_file:
+                if chunk_file.readline().split() != [CHUNK_HEADER
+                        , str(CHUNK_VERSION)]:
+                    return
+                for line in chunk_file:
+                    rel_path, size, m_time, chunks = json.loads(line)
+                    self.files[rel_path] = (size, m_time, chunks)
+        except FileNotFoundError:
+            pass
+
+    def save(self):
+        with open(os.path.join(self.root, CHUNK_FILE), 'w', newline='') \
+                as chunk_file:
+            chunk_file.write('{} {}\n'.format(CHUNK_HEADER, CHUNK_VERSION))
+            for rel_path, (size, m_time, chunks) in sorted(
+                    self.files.items()):
+                chunk_file.write(json.dumps([rel_path, size, m_time, chunks]
+                    , separators=(',', ':')))
+                chunk_file.write('\n')
+
+    def overlaps(self, min_fraction):
+        """return a list of (shared, fraction, path, other_path) for each pair
+        of files sharing at least min_fraction of the bytes of the smaller
+        one, sorted by most bytes shared
+
+        shared is the size of the distinct chunks found in both files: the
+        bytes a block-level dedup would reclaim. Files with identical chunk
+        lists are duplicates and are left out. Chunks found in more than
+        max_chunk_files files, e.g. runs of zeros, are not compared.
+        """
+        chunk_files = defaultdict(set)
+        chunk_sizes = {}
+        for rel_path, (_, _, chunks) in self.files.items():
+            for length, digest in chunks:
+                chunk_files[digest].add(rel_path)
+                chunk_sizes[digest] = length
+        shared = defaultdict(int)
+        for digest, rel_paths in chunk_files.items():
+            if 1 < len(rel_paths) <= max_chunk_files:
+                rel_paths = sorted(rel_paths)
+                for i, rel_path in enumerate(rel_paths):
+                    for other_path in rel_paths[i + 1:]:
+                        shared[rel_path, other_path] += chunk_sizes[digest]
+
+        pairs = []
+        for (rel_path, other_path), n_shared in shared.items():
+            if self.files[rel_path][2] == self.files[other_path][2]:
+                continue
+            fraction = n_shared / max(1, min(self.files[rel_path][0]
+                , self.files[other_path][0]))
+            if fraction >= min_fraction:
+                pairs.append((n_shared, fraction
+                    , os.path.join(self.root, rel_path)
+                    , os.path.join(self.root, other_path)))
+        return sorted(pairs, key=lambda pair: (-pair[0], pair[2:]))
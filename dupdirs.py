@@ -0,0 +1,113 @@
+"""Find duplicate directories from the scan records of a tree.
+
+A tree is a dict of directory paths and (files, subdirs) tuples, where files
+is a list of (name, size, csum) for each file in the directory and subdirs is
+a list of the paths of its subdirectories. Each directory gets a Merkle
+fingerprint of its files and the fingerprints of its subdirectories, so
+identical trees are found with one lookup per directory. Directories holding
+all the files of another directory are found through an index of the
+directories containing each file.
+"""
+import os
+import hashlib
+from collections import defaultdict
+
+
+def dirFingerprints(tree):
+    """return dicts of the fingerprint and total file size of each directory
+
+    fingerprints hash the sorted (name, size, csum) of each file and the
+    (name, fingerprint) of each subdirectory. A directory holding a file
+    without a csum has no duplicate, its fingerprint and the fingerprint of
+    each of its parents is None.
+    """
+    fingerprints = {}
+    sizes = {}
+    for dir_path in sorted(tree, key=len, reverse=True):
+        files, subdirs = tree[dir_path]
+        entries = []
+        fingerprint = hashlib.blake2b(digest_size=16)
+        size = 0
+        for name, file_size, csum in files:
+            if csum is None:
+                fingerprint = None
+                break
+            entries.append('f\0{}\0{}\0{}'.format(name, file_size, csum))
+            size += file_size
+        for subdir in subdirs:
+            if fingerprint is None or fingerprints.get(subdir) is None:
+                fingerprint = None
+                break
+            entries.append('d\0{}\0{}'.format(os.path.basename(subdir)
+                , fingerprints[subdir]))
+            size += sizes[subdir]
+        if fingerprint is not None:
+            for entry in sorted(entries):
+                fingerprint.update(entry.encode(errors='surrogateescape'))
+                fingerprint.update(b'\n')
+            fingerprint = fingerprint.hexdigest()
+        fingerprints[dir_path] = fingerprint
+        sizes[dir_path] = size
+    return fingerprints, sizes
+
+
+def findDupTrees(tree, fingerprints, sizes):
+    """return a list of sorted lists of identical directories
+
+    only the topmost directories of identical trees are listed, and trees
+    holding no data are skipped.
+    """
+    fp_dict = defaultdict(list)
+    for dir_path, fingerprint in fingerprints.items():
+        if fingerprint is not None and sizes[dir_path] > 0:
+            fp_dict[fingerprint].append(dir_path)
+    parents = {subdir: dir_path for dir_path, (_, subdirs) in tree.items()
+            for subdir in subdirs}
+    dup_trees = []
+    for dir_list in fp_dict.values():
+        if len(dir_list) < 2:
+            continue
+        parent_fps = set(fingerprints.get(parents.get(dir_path))
+                for dir_path in dir_list)
+        if len(parent_fps) == 1 and None not in parent_fps and \
+                len(fp_dict[parent_fps.pop()]) > 1:
+            continue
+        dup_trees.append(sorted(dir_list))
+    return sorted(dup_trees)
+
+
+def findSubsetDirs(tree, fingerprints):
+    """return a dict of directories and lists of directories whose files
+    they all hold
+
+    files are compared by (csum, size), empty files are ignored. Each
+    directory is only compared with the directories holding its least
+    common file. Directories with the same fingerprint are not listed, and
+    of two directories holding the same files only the first by path lists
+    the other.
+    """
+    key_dict = {}
+    dir_index = defaultdict(list)
+    for dir_path, (files, _) in tree.items():
+        keys = set((csum, size) if csum is not None else (None, dir_path, name)
+                for name, size, csum in files if size > 0)
+        if len(keys) > 0:
+            key_dict[dir_path] = keys
+            for key in keys:
+                dir_index[key].append(dir_path)
+
+    dup_dirs = defaultdict(list)
+    for dir_path, keys in key_dict.items():
+        rare_key = min(keys, key=lambda key: len(dir_index[key]))
+        for other_path in dir_index[rare_key]:
+            if other_path == dir_path or \
+                    fingerprints[other_path] == fingerprints[dir_path] \
+                    and fingerprints[dir_path] is not None:
+                continue
+            other_keys = key_dict[other_path]
+            if len(other_keys) == len(keys) and other_path > dir_path:
+                continue
+            if keys <= other_keys:
+                dup_dirs[other_path].append(dir_path)
+    return {dir_path: sorted(subset_dirs)
+            for dir_path, subset_dirs in dup_dirs.items()}
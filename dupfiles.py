@@ -0,0 +1,31 @@
+"""Names of the files written by deduplicate.py.
+
+PROGRAM_FILES lists every file name deduplicate.py writes into a scanned
+tree. These files are never scanned as files, and deemptydir.py does not
+count them when deciding whether a directory is empty. Files at the root of
+a tree whose name contains one of ROOT_PROGRAM_PARTS, such as the index files
+and their deltas, are program files too. The names defined
+with the module writing them are imported here so the list is kept in one
+place.
+"""
+from dupindex import SCAN_DATABASE
+from dupsnapshot import SNAPSHOT_FILE
+from dupchunks import CHUNK_FILE
+from dupcheckpoint import CHECKPOINT_FILE
+from dupserve import SERVE_SNAPSHOT, SERVE_SOCKET
+
+SCAN_RECORD = '.deduplicator_record'
+PREV_SCAN_RECORD = '.deduplicator_record_prev'
+CONFIG_FILE = 'deduplicate.ini'
+SCAN_SUMMARY = 'deduplicator_summary'
+SCAN_INDEX = 'deduplicator_index'
+PREV_SCAN_SUMMARY = 'deduplicator_summary_prev'
+SCAN_JOURNAL = 'deduplicator_journal'
+SCAN_ERRORS = 'deduplicator_errors'
+MERGED_ROWS = '.deduplicator_rows_tmp'
+COMPACT_TEMP = '.compact_tmp'
+PROGRAM_FILES = [SCAN_RECORD, PREV_SCAN_RECORD, CONFIG_FILE, SCAN_SUMMARY,
+        SCAN_INDEX, PREV_SCAN_SUMMARY, SCAN_DATABASE, SCAN_JOURNAL
+        , SNAPSHOT_FILE, MERGED_ROWS, CHUNK_FILE, CHECKPOINT_FILE, SCAN_ERRORS
+        , SERVE_SNAPSHOT, SERVE_SOCKET, COMPACT_TEMP]
+ROOT_PROGRAM_PARTS = [SCAN_INDEX]
@@ -57,7 +57,7 @@ class DupFilters:
     def subdirDepth(path):
         def recrSplit(path):
             remaining, _ = os.path.split(path)
-            if len(remaining) == 0:
+            if len(remaining) == 0 or remaining == path:
                 return 0
             else: return 1 + recrSplit(remaining)
         return recrSplit(path)
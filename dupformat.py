@@ -0,0 +1,208 @@
+"""Read and write the rows of deduplicator_summary and deduplicator_index files.
+
+Each row is a tuple (path, size, csum) with an optional fourth digest field.
+Files start with a header line naming the format version, followed by one
+JSON array per line, sorted by (size, csum, digest) so the paths of a group
+of duplicates are adjacent. Rows are read and written as generators, so a
+reader only holds one group at a time. Files written by yaml.dump in earlier
+versions are still read, but are loaded and sorted in full.
+
+The header also holds a digest of the rows of the file. A delta file lists
+the rows added (+) and removed (-) between two row files, sorted the same
+way, with the digests of the rows before and after in its header. A base
+file and its deltas are applied while reading, one row at a time.
+"""
+import json
+import heapq
+import hashlib
+from itertools import groupby
+import yaml
+
+FORMAT_HEADER = '#deduplicator-rows'
+FORMAT_VERSION = 1
+DELTA_HEADER = '#deduplicator-delta'
+DELTA_VERSION = 1
+DIGEST_SIZE = 16
+NO_DIGEST = '0' * 2 * DIGEST_SIZE
+
+
+def rowKey(row):
+    """return the (size, csum, digest) sort key of a row"""
+    return (row[1], row[2], tuple(row[3:]))
+
+
+def rowOrder(row):
+    """return the (size, csum, digest, path) order of rows in a file"""
+    return (row[1], row[2], tuple(row[3:]), row[0])
+
+
+def rowLine(row):
+    """return the line of a row in a file"""
+    path, size, csum, *digest = row
+    return json.dumps([size, csum, path, *digest], separators=(',', ':')) \
+            + '\n'
+
+
+def writeRows(file_path, rows):
+    """write an iterable of rows sorted by rowKey to file_path
+
+    return the digest of the rows, which is written in the header once all
+    rows are written.
+    """
+    rows_digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(file_path, 'w', newline='') as row_file:
+        row_file.write('{} {} {}\n'.format(FORMAT_HEADER, FORMAT_VERSION
+            , NO_DIGEST))
+        for row in rows:
+            line = rowLine(row)
+            rows_digest.update(line.encode(errors='surrogateescape'))
+            row_file.write(line)
+        row_file.seek(0)
+        row_file.write('{} {} {}\n'.format(FORMAT_HEADER, FORMAT_VERSION
+            , rows_digest.hexdigest()))
+    return rows_digest.hexdigest()
+
+
+def readHeader(file_path):
+    """return ('rows', digest) or ('delta', base_digest, result_digest) from
+    the header of file_path
+
+    digest is None for files written without one, and for files written by
+    yaml.dump the result is ('yaml', None).
+    """
+    with open(file_path, newline='') as row_file:
+        fields = row_file.readline().split()
+    if fields[:1] == [DELTA_HEADER]:
+        checkVersion(file_path, int(fields[1]), DELTA_VERSION)
+        return ('delta', fields[2], fields[3])
+    if fields[:1] == [FORMAT_HEADER]:
+        checkVersion(file_path, int(fields[1]), FORMAT_VERSION)
+        digest = fields[2] if len(fields) > 2 else None
+        return ('rows', digest if digest != NO_DIGEST else None)
+    return ('yaml', None)
+
+
+def checkVersion(file_path, version, expected_version):
+    if version > expected_version:
+        raise ValueError('{} has format version {}, expected {}'.format(
+            file_path, version, expected_version))
+
+
+def readRows(file_path):
+    """yield each row of file_path in rowKey order"""
+    with open(file_path, newline='') as row_file:
+        header = row_file.readline()
+        if not header.startswith(FORMAT_HEADER):
+            row_file.seek(0)
+            yield from sorted(yaml.load(row_file, Loader=yaml.FullLoader)
+                    or [], key=rowOrder)
+            return
+        checkVersion(file_path, int(header.split()[1]), FORMAT_VERSION)
+        for line in row_file:
+            size, csum, path, *digest = json.loads(line)
+            yield (path, size, csum, *digest)
+
+
+def groupRows(rows):
+    """yield (csum, size, paths) for each group of rows with equal rowKey
+
+    rows must be sorted by rowKey.
+    """
+    for (size, csum, _), group in groupby(rows, key=rowKey):
+        yield (csum, size, [row[0] for row in group])
+
+
+def readGroups(file_path):
+    """yield (csum, size, paths) for each group of rows in file_path"""
+    return groupRows(readRows(file_path))
+
+
+def mergeRows(*row_iters):
+    """merge iterables of rows each sorted by rowKey into one sorted iterator"""
+    return heapq.merge(*row_iters, key=rowKey)
+
+
+def diffRows(old_rows, new_rows):
+    """yield ('-', row) for each row of old_rows missing from new_rows and
+    ('+', row) for each row of new_rows missing from old_rows
+
+    both iterables must be sorted by rowOrder, as rows are in a file. The
+    changes are yielded in rowOrder.
+    """
+    old_iter = iter(old_rows)
+    new_iter = iter(new_rows)
+    old_row = next(old_iter, None)
+    new_row = next(new_iter, None)
+    while old_row is not None or new_row is not None:
+        if new_row is None or old_row is not None \
+                and rowOrder(old_row) < rowOrder(new_row):
+            yield ('-', old_row)
+            old_row = next(old_iter, None)
+        elif old_row is None or rowOrder(new_row) < rowOrder(old_row):
+            yield ('+', new_row)
+            new_row = next(new_iter, None)
+        else:
+            old_row = next(old_iter, None)
+            new_row = next(new_iter, None)
+
+
+def writeDelta(file_path, old_rows, new_rows):
+    """write the changes from old_rows to new_rows to file_path
+
+    return (base_digest, result_digest, n_changes), the digests of old_rows
+    and new_rows as writeRows would return them. Both digests are written in
+    the header.
+    """
+    def digestRows(rows, rows_digest):
+        for row in rows:
+            rows_digest.update(rowLine(row).encode(errors='surrogateescape'))
+            yield row
+
+    base_digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    result_digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    n_changes = 0
+    with open(file_path, 'w', newline='') as delta_file:
+        delta_file.write('{} {} {} {}\n'.format(DELTA_HEADER, DELTA_VERSION
+            , NO_DIGEST, NO_DIGEST))
+        for op, row in diffRows(digestRows(old_rows, base_digest)
+                , digestRows(new_rows, result_digest)):
+            delta_file.write(op + rowLine(row))
+            n_changes += 1
+        delta_file.seek(0)
+        delta_file.write('{} {} {} {}\n'.format(DELTA_HEADER, DELTA_VERSION
+            , base_digest.hexdigest(), result_digest.hexdigest()))
+    return base_digest.hexdigest(), result_digest.hexdigest(), n_changes
+
+
+def readDelta(file_path):
+    """yield each (op, row) of a delta file in rowOrder"""
+    with open(file_path, newline='') as delta_file:
+        delta_file.readline()
+        for line in delta_file:
+            size, csum, path, *digest = json.loads(line[1:])
+            yield (line[0], (path, size, csum, *digest))
+
+
+def applyDelta(rows, changes, mismatch=None):
+    """yield rows with the (op, row) changes of a delta applied, in rowOrder
+
+    rows and changes must be sorted by rowOrder. A removed row missing from
+    rows or an added row already in rows is counted in mismatch[0] if a
+    list is given.
+    """
+    row_iter = iter(rows)
+    row = next(row_iter, None)
+    for op, change_row in changes:
+        while row is not None and rowOrder(row) < rowOrder(change_row):
+            yield row
+            row = next(row_iter, None)
+        found = row is not None and rowOrder(row) == rowOrder(change_row)
+        if found == (op == '+') and mismatch is not None:
+            mismatch[0] += 1
+        if found:
+            row = next(row_iter, None)
+        if op == '+':
+            yield change_row
+    while row is not None:
+        yield row
+        row = next(row_iter, None)
@@ -0,0 +1,100 @@
+"""Run checksum functions over many files concurrently.
+
+zlib.crc32 releases the GIL, so a thread pool keeps several reads in flight on
+storage which can serve them at once. A process pool may be selected instead.
+Reads failing on degraded media are tried again by retryRead, and their error
+is returned instead of ending the run.
+"""
+import time
+import hashlib
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor, wait
+        , FIRST_COMPLETED)
+
+max_inflight_mb = 256
+digest_buffer_kb = 1024
+max_read_attempts = 3
+retry_delay = 0.5
+
+
+class HashExecutor():
+    def __init__(self, jobs=1, processes=False):
+        self.jobs = jobs
+        self.processes = processes
+
+    def map(self, func, task_list, stop=None):
+        """yield (key, func(*args)) for each (key, args, n_bytes) in task_list
+
+        results are yielded in completion order. Calls are started while the
+        n_bytes of all running calls stay within max_inflight_mb, a single
+        call always runs. With one job each call runs in the current thread.
+        No call is started once stop() returns True, the calls running are
+        still yielded.
+        """
+        if self.jobs < 2:
+            for key, args, _ in task_list:
+                if stop is not None and stop():
+                    return
+                yield key, func(*args)
+            return
+
+        max_inflight = max_inflight_mb * 1024 * 1024
+        pool_type = ProcessPoolExecutor if self.processes \
+                else ThreadPoolExecutor
+        with pool_type(max_workers=self.jobs) as pool:
+            running = {}
+            inflight = 0
+            for key, args, n_bytes in task_list:
+                while running and (inflight + n_bytes > max_inflight
+                        or len(running) >= 2 * self.jobs):
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        done_key, done_bytes = running.pop(future)
+                        inflight -= done_bytes
+                        yield done_key, future.result()
+                if stop is not None and stop():
+                    break
+                running[pool.submit(func, *args)] = (key, n_bytes)
+                inflight += n_bytes
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    done_key, _ = running.pop(future)
+                    yield done_key, future.result()
+
+
+def fileDigest(filename):
+    """return the BLAKE2b digest of the full contents of a file as hex string
+
+    the file is read unbuffered into a single reused buffer of
+    digest_buffer_kb, so no data is copied before hashing.
+    """
+    digest = hashlib.blake2b()
+    buffer = bytearray(digest_buffer_kb * 1024)
+    view = memoryview(buffer)
+    with open(filename, 'rb', buffering=0) as fh:
+        while True:
+            n_read = fh.readinto(buffer)
+            if not n_read:
+                break
+            digest.update(view[:n_read])
+    return digest.hexdigest()
+
+
+def retryRead(func, *args):
+    """return (func(*args), None), or (None, error) if func raised an OSError
+    in each of max_read_attempts
+
+    attempts are retry_delay seconds apart, doubled after each attempt. A
+    file not found is not tried again.
+    """
+    delay = retry_delay
+    for attempt in range(1, max_read_attempts + 1):
+        try:
+            return func(*args), None
+        except FileNotFoundError as E:
+            return None, E
+        except OSError as E:
+            if attempt == max_read_attempts:
+                return None, E
+            time.sleep(delay)
+            delay *= 2
@@ -0,0 +1,215 @@
+"""Store the scan records of a whole tree in a single sqlite database.
+
+An alternative to writing a .deduplicator_record in every directory. Rows are
+keyed by the path of each file relative to the scan root, and a rescan reuses
+the checksum of any row with the same inode, size and mtime, so files which
+were moved or renamed are not read again. The path of every directory below
+the root is kept as well, so empty directories are known without a listing,
+unless the build left files out by [scan] rules.
+"""
+import os
+import sqlite3
+
+SCAN_DATABASE = '.deduplicator_db'
+
+
+class ScanIndex():
+    def __init__(self, root):
+        self.root = root
+        self.connection = sqlite3.connect(os.path.join(root, SCAN_DATABASE))
+        with self.connection:
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, inode INTEGER, dev INTEGER
+                , size INTEGER, mtime REAL, csum INTEGER)''')
+            self.connection.execute('''CREATE INDEX IF NOT EXISTS
+                files_size_csum ON files (size, csum)''')
+            self.connection.execute('''CREATE INDEX IF NOT EXISTS
+                files_inode ON files (inode, dev)''')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY)''')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS build (
+                scoped INTEGER)''')
+        self.reused = 0
+
+    def storedCsum(self, file_stat, reuse=True):
+        """return the csum of a row matching file_stat or None if not found
+
+        a row matches if it has the same inode, device, size and mtime, its
+        path is not compared. If reuse is False or the file is empty no row is
+        looked up.
+        """
+        if not reuse or file_stat.st_size == 0:
+            return None
+        csum = self.inodeCsum(file_stat)
+        if csum is not None:
+            self.reused += 1
+        return csum
+
+    def inodeCsum(self, file_stat):
+        """return the csum of a row with the inode, size and mtime of file_stat
+
+        return None if there is no such row with a csum.
+        """
+        row = self.connection.execute('''SELECT csum FROM files
+            WHERE inode = ? AND dev = ? AND size = ? AND mtime = ?
+            AND csum IS NOT NULL''', (file_stat.st_ino, file_stat.st_dev
+                , file_stat.st_size, file_stat.st_mtime)).fetchone()
+        return None if row is None else row[0]
+
+    def fileRow(self, rel_path):
+        """return (inode, dev, size, mtime) of the row of rel_path or None"""
+        return self.connection.execute('''SELECT inode, dev, size, mtime
+            FROM files WHERE path = ?''', (rel_path,)).fetchone()
+
+    def sizeRows(self, size):
+        """return a list of (path, csum) of the rows with file size size"""
+        return self.connection.execute(
+                'SELECT path, csum FROM files WHERE size = ?', (size,)
+                ).fetchall()
+
+    def uncheckedRows(self):
+        """return a list of (path, size) of the non empty files without a
+        csum, such as files whose size was unique when built
+        """
+        return self.connection.execute('''SELECT path, size FROM files
+            WHERE size > 0 AND csum IS NULL''').fetchall()
+
+    def filePaths(self):
+        return [path for path, in self.connection.execute(
+            'SELECT path FROM files')]
+
+    def dirPaths(self):
+        return [path for path, in self.connection.execute(
+            'SELECT path FROM dirs')]
+
+    def isEmpty(self):
+        """return True if no file or directory is stored, as before the
+        first build --db
+        """
+        return self.connection.execute('''SELECT NOT EXISTS (SELECT 1 FROM files)
+            AND NOT EXISTS (SELECT 1 FROM dirs)''').fetchone()[0] == 1
+
+    def isScoped(self):
+        """return True if the last build left out files by [scan] rules, so
+        the rows do not list every file of the tree
+        """
+        row = self.connection.execute('SELECT scoped FROM build').fetchone()
+        return row is not None and row[0] == 1
+
+    def setDir(self, rel_path):
+        self.connection.execute('INSERT OR IGNORE INTO dirs VALUES (?)'
+                , (rel_path,))
+
+    def setRow(self, rel_path, file_stat, csum):
+        self.connection.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)'
+                , (rel_path, file_stat.st_ino, file_stat.st_dev
+                    , file_stat.st_size, file_stat.st_mtime, csum))
+
+    def setCsum(self, rel_path, csum):
+        self.connection.execute('UPDATE files SET csum = ? WHERE path = ?'
+                , (csum, rel_path))
+
+    def removePath(self, rel_path):
+        """delete the row of rel_path and the rows of all paths below it"""
+        for table in ('files', 'dirs'):
+            self.connection.execute('''DELETE FROM {} WHERE path = ?
+                OR substr(path, 1, ?) = ?'''.format(table)
+                , (rel_path, len(rel_path) + 1, rel_path + os.sep))
+
+    def movePath(self, old_path, new_path):
+        """rename the row of old_path and the rows of all paths below it
+
+        rows at new_path are replaced.
+        """
+        self.removePath(new_path)
+        for table in ('files', 'dirs'):
+            self.connection.execute('''UPDATE {}
+                SET path = ? || substr(path, ?)
+                WHERE path = ? OR substr(path, 1, ?) = ?'''.format(table)
+                , (new_path, len(old_path) + 1, old_path, len(old_path) + 1
+                    , old_path + os.sep))
+
+    def commit(self):
+        self.connection.commit()
+
+    def saveRecords(self, dir_records, scoped=False):
+        """replace all rows with the FileRecords of dir_records
+
+        dir_records is an iterable of (dir_path, fr_list) pairs, the path of
+        each directory and a list of the FileRecords of each file in it, such
+        as the items of scan_records. Each directory but the root gets a row
+        in dirs. scoped is set if [scan] rules left files or directories out
+        of dir_records.
+        """
+        with self.connection:
+            self.connection.execute('DELETE FROM files')
+            self.connection.execute('DELETE FROM dirs')
+            self.connection.execute('DELETE FROM build')
+            self.connection.execute('INSERT INTO build VALUES (?)'
+                    , (int(scoped),))
+            for dir_path, fr_list in dir_records:
+                rel_dir = os.path.relpath(dir_path, self.root)
+                if rel_dir != '.':
+                    self.connection.execute('INSERT INTO dirs VALUES (?)'
+                            , (rel_dir,))
+                self.connection.executemany(
+                        'INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)'
+                        , ((os.path.relpath(os.path.join(dir_path, fr.name)
+                            , self.root), fr.inode, fr.dev, fr.size
+                            , fr.m_time, fr.csum) for fr in fr_list))
+
+    def sortedRows(self, all_files=False):
+        """yield (path, size, csum) of the duplicate files in the database
+
+        rows are sorted by size and csum, groups of duplicates are found with
+        a single GROUP BY query. Hard links to one inode are a single file,
+        listed by their first path. Empty files are excluded. If all_files is
+        set, every checksummed file is included.
+        """
+        if all_files:
+            rows = self.connection.execute('''SELECT min(path), size, csum
+                FROM files WHERE size > 0 AND csum IS NOT NULL
+                GROUP BY size, csum, dev, inode
+                ORDER BY size, csum, 1''')
+        else:
+            rows = self.connection.execute('''SELECT min(path), size, csum
+                FROM files WHERE size > 0 AND csum IS NOT NULL
+                AND (size, csum) IN (
+                    SELECT size, csum FROM (SELECT DISTINCT size, csum, dev
+                        , inode FROM files
+                        WHERE size > 0 AND csum IS NOT NULL)
+                    GROUP BY size, csum HAVING count(*) > 1)
+                GROUP BY size, csum, dev, inode
+                ORDER BY size, csum, 1''')
+        for path, size, csum in rows:
+            yield (os.path.join(self.root, path), size, csum)
+
+    def loadTree(self):
+        """return a dict of the rows of every directory holding a file
+
+        values in dict are tuples (files, subdirs) as returned by
+        deduplicate.loadTree, with paths joined to the scan root.
+        """
+        def dirPath(rel_dir):
+            return os.path.join(self.root, rel_dir) if rel_dir else self.root
+
+        tree = {}
+        for path, size, csum in self.connection.execute(
+                'SELECT path, size, csum FROM files'):
+            rel_dir, name = os.path.split(path)
+            tree.setdefault(dirPath(rel_dir), ([], []))[0].append(
+                    (name, size, csum))
+        linked = set()
+        for rel_dir in set(os.path.dirname(path) for path, in
+                self.connection.execute('SELECT path FROM files')):
+            while rel_dir and rel_dir not in linked:
+                linked.add(rel_dir)
+                parent = os.path.dirname(rel_dir)
+                tree.setdefault(dirPath(parent), ([], []))[1].append(
+                        dirPath(rel_dir))
+                rel_dir = parent
+        return tree
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,50 @@
+"""Record the files removed or replaced by delete, link and reflink.
+
+The journal is an append-only file of one JSON array [status, path] per line,
+written as each file is done. Its header holds the action and the size and
+mtime of the summary it was made from, so the same action interrupted on the
+same summary reads the journal back and skips the paths already done, and any
+other action starts a new journal. After a run it reports
+exactly which files were changed. The paths done are kept in a
+dupmodel.PathTable.
+"""
+import os
+import sys
+import json
+from dupmodel import PathTable
+
+JOURNAL_HEADER = '#deduplicator-journal'
+JOURNAL_VERSION = 2
+DONE_STATUS = ['DELETED', 'LINKED', 'ALREADY LINKED']
+
+
+class ActionJournal():
+    def __init__(self, journal_path, summary_path, action):
+        summary_stat = os.stat(summary_path)
+        header = '{} {} {} {} {}\n'.format(JOURNAL_HEADER, JOURNAL_VERSION
+                , action, summary_stat.st_size, summary_stat.st_mtime_ns)
+        self.done = PathTable()
+        resume = False
+        if os.path.isfile(journal_path):
+            with open(journal_path, newline='') as journal_file:
+                resume = journal_file.readline() == header
+                for line in journal_file if resume else []:
+                    try:
+                        status, path = json.loads(line)
+                    except ValueError:
+                        break
+                    if status in DONE_STATUS:
+                        self.done[path] = sys.intern(status)
+        self.journal_file = open(journal_path, 'a' if resume else 'w'
+                , buffering=1, newline='')
+        if resume:
+            print('resuming from {}: {} files done'.format(
+                journal_path, len(self.done)))
+        else:
+            self.journal_file.write(header)
+
+    def record(self, path, status):
+        self.journal_file.write(json.dumps([status, path]) + '\n')
+
+    def close(self):
+        self.journal_file.close()
@@ -0,0 +1,95 @@
+"""Replace duplicate files with links to a primary copy.
+
+A duplicate is replaced by a hard link, or by a copy-on-write clone made with
+the Linux FICLONE ioctl on filesystems supporting it (btrfs, XFS). The link is
+created under a temporary name in the directory of the duplicate and renamed
+over it, so the path always names either the old or the new file. A clone
+keeps the owner, group and extended attributes of the file it replaces. A
+temporary file left by an interrupted run is removed before it is created
+again.
+"""
+import os
+import errno
+import fcntl
+import shutil
+
+FICLONE = 0x40049409
+TEMP_SUFFIX = '.deduplicator_tmp'
+
+
+def tempPath(path):
+    """return the temporary path of the link replacing path, removing the
+    file left there by an interrupted run if any
+    """
+    dir_path, name = os.path.split(path)
+    temp_path = os.path.join(dir_path, '.' + name + TEMP_SUFFIX)
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+    return temp_path
+
+
+def linkFile(src_path, dst_path):
+    """replace dst_path with a hard link to src_path
+
+    return False if both paths are already links to the same inode.
+    """
+    if os.path.samefile(src_path, dst_path):
+        return False
+    temp_path = tempPath(dst_path)
+    os.link(src_path, temp_path)
+    try:
+        os.replace(temp_path, dst_path)
+    except OSError:
+        os.remove(temp_path)
+        raise
+    return True
+
+
+def reflinkFile(src_path, dst_path):
+    """replace dst_path with a copy-on-write clone of src_path
+
+    the clone gets the owner, group, extended attributes, permissions and
+    timestamps of dst_path, or dst_path is kept if they can not be copied.
+    Return False if both paths are already links to the same inode.
+    """
+    if os.path.samefile(src_path, dst_path):
+        return False
+    temp_path = tempPath(dst_path)
+    with open(src_path, 'rb') as src_file, \
+            open(temp_path, 'xb') as temp_file:
+        try:
+            fcntl.ioctl(temp_file.fileno(), FICLONE, src_file.fileno())
+        except OSError:
+            temp_file.close()
+            os.remove(temp_path)
+            raise
+    try:
+        dst_stat = os.stat(dst_path, follow_symlinks=False)
+        os.chown(temp_path, dst_stat.st_uid, dst_stat.st_gid)
+        copyXattrs(dst_path, temp_path)
+        shutil.copystat(dst_path, temp_path)
+        os.replace(temp_path, dst_path)
+    except OSError:
+        os.remove(temp_path)
+        raise
+    return True
+
+
+def copyXattrs(src_path, dst_path):
+    """copy every extended attribute of src_path to dst_path
+
+    nothing is copied if the filesystem of src_path has none.
+    """
+    if not hasattr(os, 'listxattr'):
+        return
+    try:
+        names = os.listxattr(src_path, follow_symlinks=False)
+    except OSError as E:
+        if E.errno in (errno.ENOTSUP, errno.EOPNOTSUPP):
+            return
+        raise
+    for name in names:
+        os.setxattr(dst_path, name, os.getxattr(src_path, name
+            , follow_symlinks=False), follow_symlinks=False)
@@ -0,0 +1,99 @@
+"""Compact in-memory records of very large trees.
+
+A build keeps a record of every file, and a delete, link or reflink resumed
+from its journal keeps every path already done. At tens of millions of files
+a namedtuple per record, with a list of dups each, and a full path string per
+path done take most of the memory. FileRecord holds its fields in __slots__
+and shares one empty dups tuple until a file has duplicates. PathTable keeps
+each directory path once, in a table of interned directories, and only the
+name of each file below it.
+"""
+import os
+
+RECORD_FIELDNAMES = ['name', 'size', 'csum', 'm_time', 'dups', 'inode', 'dev']
+
+
+class FileRecord():
+    """the scan record of a file, with the fields and methods of the
+    namedtuple it replaces
+
+    dups is an empty tuple until addDups is called.
+    """
+    __slots__ = RECORD_FIELDNAMES
+
+    def __init__(self, name, size, csum, m_time, dups=(), inode=None
+            , dev=None):
+        self.name = name
+        self.size = size
+        self.csum = csum
+        self.m_time = m_time
+        self.dups = dups if dups else ()
+        self.inode = inode
+        self.dev = dev
+
+    def __iter__(self):
+        return (getattr(self, field) for field in RECORD_FIELDNAMES)
+
+    def __eq__(self, other):
+        return isinstance(other, FileRecord) and tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return 'FileRecord({})'.format(', '.join('{}={!r}'.format(field
+            , value) for field, value in zip(RECORD_FIELDNAMES, self)))
+
+    def _replace(self, **fields):
+        values = dict(zip(RECORD_FIELDNAMES, self), **fields)
+        return FileRecord(**values)
+
+    def _asdict(self):
+        """return a dict of the fields, with dups as a list"""
+        values = dict(zip(RECORD_FIELDNAMES, self))
+        values['dups'] = list(self.dups)
+        return values
+
+    def addDups(self, paths):
+        paths = list(paths)
+        if paths:
+            self.dups = list(self.dups) + paths
+
+
+class PathTable():
+    """a mapping of paths to values, storing each directory once
+
+    directories are interned in a list, and the values of the files of each
+    directory are kept in a dict by file name.
+    """
+    def __init__(self):
+        self.dir_ids = {}
+        self.dir_files = []
+        self.length = 0
+
+    def _dir(self, path, create=False):
+        dir_path, name = os.path.split(path)
+        dir_id = self.dir_ids.get(dir_path)
+        if dir_id is None and create:
+            dir_id = self.dir_ids[dir_path] = len(self.dir_files)
+            self.dir_files.append({})
+        return (None if dir_id is None else self.dir_files[dir_id]), name
+
+    def __setitem__(self, path, value):
+        names, name = self._dir(path, create=True)
+        if name not in names:
+            self.length += 1
+        names[name] = value
+
+    def __getitem__(self, path):
+        names, name = self._dir(path)
+        if names is None:
+            raise KeyError(path)
+        return names[name]
+
+    def __contains__(self, path):
+        names, name = self._dir(path)
+        return names is not None and name in names
+
+    def __len__(self):
+        return self.length
+
+    def get(self, path, default=None):
+        return self[path] if path in self else default
@@ -0,0 +1,84 @@
+"""Order file reads by their location on disk.
+
+On spinning disks and tape-backed mounts, reading files in path order seeks
+back and forth across the platter. Files are instead read in order of the
+physical offset of their first extent, found with the FIEMAP ioctl (Linux),
+and in order of inode number where FIEMAP is not supported, since most
+filesystems allocate inodes and data near each other. Reads are also hinted
+with posix_fadvise, sequential while a file is read and DONTNEED after it, so
+the pages of a build do not stay in the page cache.
+"""
+import os
+import struct
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_HEADER = struct.Struct('=QQLLLL')
+FIEMAP_EXTENT = struct.Struct('=QQQQQLLLL')
+ADVISE = hasattr(os, 'posix_fadvise')
+
+
+def firstExtent(filename):
+    """return the physical byte offset of the first extent of a file
+
+    return None if the filesystem does not support FIEMAP or the file has no
+    mapped extent, e.g. its data is inline or not yet allocated.
+    """
+    if fcntl is None:
+        return None
+    request = bytearray(FIEMAP_HEADER.size + FIEMAP_EXTENT.size)
+    FIEMAP_HEADER.pack_into(request, 0, 0, 2 ** 64 - 1, 0, 0, 1, 0)
+    try:
+        with open(filename, 'rb', buffering=0) as fh:
+            fcntl.ioctl(fh.fileno(), FS_IOC_FIEMAP, request)
+    except OSError:
+        return None
+    if FIEMAP_HEADER.unpack_from(request)[3] < 1:
+        return None
+    return FIEMAP_EXTENT.unpack_from(request, FIEMAP_HEADER.size)[1]
+
+
+def diskOrder(entries, executor, counters=None):
+    """return entries sorted by the location on disk of their files
+
+    entries is a list of (key, filename, dev, inode). Files on each device are
+    sorted by firstExtent, followed by those without one sorted by inode.
+    The extents are looked up with executor, a duphash.HashExecutor. The
+    number of files placed by extent and by inode is added to counters.
+    """
+    keys = diskKeys([entry[1:] for entry in entries], executor, counters)
+    order = sorted(range(len(entries)), key=keys.__getitem__)
+    return [entries[i] for i in order]
+
+
+def diskKeys(files, executor, counters=None):
+    """return the list of the keys sorting each (filename, dev, inode) of
+    files by its location on disk, as diskOrder does
+    """
+    keys = [None] * len(files)
+    tasks = [(i, (filename,), 0) for i, (filename, _, _) in enumerate(files)]
+    for i, offset in executor.map(firstExtent, tasks):
+        _, dev, inode = files[i]
+        keys[i] = (dev, 1, inode) if offset is None else (dev, 0, offset)
+    if counters is not None:
+        n_extents = sum(1 for key in keys if key[1] == 0)
+        counters['extent_ordered'] = counters.get('extent_ordered', 0) \
+                + n_extents
+        counters['inode_ordered'] = counters.get('inode_ordered', 0) \
+                + len(keys) - n_extents
+    return keys
+
+
+def adviseSequential(fh):
+    if ADVISE:
+        os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+
+def adviseDone(fh):
+    """let the kernel drop the cached pages of a file which was read"""
+    if ADVISE:
+        os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
@@ -0,0 +1,99 @@
+"""Rules limiting which files and directories a build scans.
+
+The rules are read from the [scan] section of deduplicate.ini:
+
+    [scan]
+    include: *.iso
+      *.img
+    exclude: *.tmp
+    prune: .git
+      node_modules
+      cache/*
+    min size: 4K
+    max size: 10G
+    same filesystem: yes
+
+include, exclude and prune are lists of glob patterns, one per line. A
+pattern holding a path separator is matched against the path relative to
+the scan root, any other against the file or directory name. Only files
+matching an include pattern (if any) and no exclude pattern are scanned.
+Directories matching a prune pattern are not listed at all. min size and max
+size take a number of bytes with an optional K, M or G suffix (KiB, MiB,
+GiB), and same filesystem skips the directories on another device than the
+scan root. Patterns are compiled once into a single regular expression per
+list.
+"""
+import os
+import re
+import fnmatch
+import hashlib
+import configparser
+
+SIZE_SUFFIXES = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3
+        , 'T': 1024 ** 4}
+
+
+def parseSize(value):
+    """return the number of bytes of a size like 4096, 4K or 1.5G"""
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([KMGT]?)i?B?\s*', value
+            , re.IGNORECASE)
+    if match is None:
+        raise ValueError('invalid size in [scan] section: {}'.format(value))
+    return int(float(match.group(1)) * SIZE_SUFFIXES[match.group(2).upper()])
+
+
+def compilePatterns(value):
+    """return (name_regex, path_regex) matching any glob listed in value
+
+    either is None if no pattern of its kind is listed.
+    """
+    patterns = [line.strip() for line in value.splitlines() if line.strip()]
+    name_patterns = [fnmatch.translate(pattern) for pattern in patterns
+            if os.sep not in pattern]
+    path_patterns = [fnmatch.translate(pattern.strip(os.sep))
+            for pattern in patterns if os.sep in pattern]
+    return tuple(re.compile('|'.join(pattern_list)) if pattern_list else None
+            for pattern_list in (name_patterns, path_patterns))
+
+
+def matches(regexes, rel_path):
+    name_regex, path_regex = regexes
+    return (name_regex is not None and name_regex.match(
+        os.path.basename(rel_path)) is not None) or (path_regex is not None
+            and path_regex.match(rel_path) is not None)
+
+
+class ScanScope():
+    """the [scan] rules of the deduplicate.ini at config_path
+
+    rel_path arguments are relative to the scan root.
+    """
+    def __init__(self, config_path):
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        section = config['scan'] if 'scan' in config else {}
+        self.include = compilePatterns(section.get('include', ''))
+        self.exclude = compilePatterns(section.get('exclude', ''))
+        self.prune = compilePatterns(section.get('prune', ''))
+        self.min_size = parseSize(section['min size']) \
+                if 'min size' in section else None
+        self.max_size = parseSize(section['max size']) \
+                if 'max size' in section else None
+        self.same_filesystem = config.getboolean('scan', 'same filesystem'
+                , fallback=False)
+        self.key = hashlib.blake2b(repr(sorted(dict(section).items()))
+                .encode(errors='surrogateescape'), digest_size=8).hexdigest()
+        self.has_include = self.include != (None, None)
+        self.has_size = self.min_size is not None or self.max_size is not None
+        self.active = len(section) > 0
+
+    def skipDir(self, rel_path):
+        return matches(self.prune, rel_path)
+
+    def skipFile(self, rel_path):
+        return (self.has_include and not matches(self.include, rel_path)) \
+                or matches(self.exclude, rel_path)
+
+    def skipSize(self, size):
+        return (self.min_size is not None and size < self.min_size) \
+                or (self.max_size is not None and size > self.max_size)
@@ -0,0 +1,165 @@
+"""Answer duplicate lookups from a resident table over a Unix socket.
+
+The rows of an index are loaded once into a dict keyed by (size, csum), and
+served by asyncio on a local Unix domain socket. Each request is one line of
+JSON, answered by one line of JSON on the same connection:
+
+    {"op": "lookup", "files": [[size, csum], ...]}
+        -> {"matches": [[path, ...], ...]}
+    {"op": "add", "files": [[path, size, csum], ...]} -> {"added": n}
+    {"op": "remove", "files": [[path, size, csum], ...]} -> {"removed": n}
+    {"op": "stats"} -> {"files": n, "keys": n}
+
+csum is the crc32 of deduplicate.py, of the leading max_checksum_mb of the
+file. A lookup returns the paths of the files with the size and csum of each
+file queried, an empty list if there are none. Any number of requests may be
+sent on a connection, and many connections are served at once. On SIGINT or
+SIGTERM the table is saved to SERVE_SNAPSHOT, which the next serve loads
+instead of the index files it was made from while they did not change.
+"""
+import os
+import json
+import signal
+import socket
+import asyncio
+from collections import defaultdict
+
+SERVE_SNAPSHOT = '.deduplicator_served'
+SERVE_SOCKET = '.deduplicator_socket'
+SNAPSHOT_HEADER = '#deduplicator-served'
+SNAPSHOT_VERSION = 1
+max_request_mb = 16
+socket_backlog = 1024
+
+
+class LookupTable():
+    """the paths of the files of an index, keyed by (size, csum)"""
+    def __init__(self):
+        self.paths = defaultdict(list)
+        self.n_files = 0
+
+    def load(self, rows):
+        """add the paths of rows of (path, size, csum), listed once each"""
+        for path, size, csum in rows:
+            self.paths[size, csum].append(path)
+            self.n_files += 1
+
+    def add(self, path, size, csum):
+        """add path, return False if it was listed with size and csum"""
+        paths = self.paths[size, csum]
+        if path in paths:
+            return False
+        paths.append(path)
+        self.n_files += 1
+        return True
+
+    def remove(self, path, size, csum):
+        """remove path, return False if it was not listed with size and csum"""
+        paths = self.paths.get((size, csum))
+        if paths is None or path not in paths:
+            return False
+        paths.remove(path)
+        if not paths:
+            del self.paths[size, csum]
+        self.n_files -= 1
+        return True
+
+    def lookup(self, size, csum):
+        return self.paths.get((size, csum), [])
+
+    def handle(self, request):
+        """return the response to a request dict"""
+        op = request.get('op')
+        files = request.get('files', [])
+        if op == 'lookup':
+            return {'matches': [self.lookup(size, csum)
+                for size, csum in files]}
+        if op == 'add':
+            return {'added': sum(self.add(path, size, csum)
+                for path, size, csum in files)}
+        if op == 'remove':
+            return {'removed': sum(self.remove(path, size, csum)
+                for path, size, csum in files)}
+        if op == 'stats':
+            return {'files': self.n_files, 'keys': len(self.paths)}
+        return {'error': 'unknown op: {}'.format(op)}
+
+    def save(self, snapshot_path, sources):
+        """write the table to snapshot_path, with the list of the sources it
+        was loaded from
+        """
+        temp_path = snapshot_path + '_tmp'
+        with open(temp_path, 'w', newline='') as snapshot_file:
+            snapshot_file.write('{} {} {}\n'.format(SNAPSHOT_HEADER
+                , SNAPSHOT_VERSION, json.dumps(sources, separators=(',', ':'))))
+            for (size, csum), paths in self.paths.items():
+                snapshot_file.write(json.dumps([size, csum, paths]
+                    , separators=(',', ':')))
+                snapshot_file.write('\n')
+        os.replace(temp_path, snapshot_path)
+
+
+def loadTable(snapshot_path, sources):
+    """return the LookupTable saved at snapshot_path, or None if there is
+    none or it was loaded from other sources
+    """
+    try:
+        with open(snapshot_path, newline='') as snapshot_file:
+            header, version, saved_sources = \
+                    snapshot_file.readline().split(' ', 2)
+            if header != SNAPSHOT_HEADER or version != str(SNAPSHOT_VERSION) \
+                    or json.loads(saved_sources) != sources:
+                return None
+            table = LookupTable()
+            for line in snapshot_file:
+                size, csum, paths = json.loads(line)
+                table.paths[size, csum] = paths
+                table.n_files += len(paths)
+            return table
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+async def serveTable(table, socket_path):
+    """serve table on socket_path until SIGINT or SIGTERM is received"""
+    async def handleClient(reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = table.handle(json.loads(line))
+                except (ValueError, TypeError, AttributeError) as E:
+                    response = {'error': 'invalid request: {}'.format(E)}
+                writer.write(json.dumps(response, separators=(',', ':'))
+                        .encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    stop = asyncio.get_running_loop().create_future()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(signum
+                , lambda: stop.done() or stop.set_result(None))
+    server = await asyncio.start_unix_server(handleClient, socket_path
+            , limit=max_request_mb * 1024 * 1024, backlog=socket_backlog)
+    print('serving {} files on {}'.format(table.n_files, socket_path))
+    try:
+        async with server:
+            await stop
+    finally:
+        os.remove(socket_path)
+
+
+def query(socket_path, request):
+    """send one request dict to a serve on socket_path, return its response"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode() + b'\n')
+        with client.makefile('rb') as response_file:
+            return json.loads(response_file.readline())
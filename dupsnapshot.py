@@ -0,0 +1,284 @@
+"""List a whole tree once and keep its entries for every later phase.
+
+Each directory is listed with a single os.scandir call, and the stat results
+of its files are taken while it is listed, so no phase of a run lists a
+directory or stats a file again. Directories are listed by a pool of threads
+when more than one job is given, which keeps several listings in flight on
+network filesystems where each one is a round trip. A snapshot may be saved
+to SNAPSHOT_FILE and handed to the next run, which reuses the entries of
+every directory whose inode and mtime did not change. The files of a reused
+directory are still stat'ed again, since a file written in place does not
+change the mtime of its directory. A dupscope.ScanScope leaves out files and
+directories while they are listed, so a pruned subtree is never listed. A
+lazy snapshot only lists the tree as it is walked, and keeps one listing.
+"""
+import os
+import json
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+SNAPSHOT_FILE = '.deduplicator_snapshot'
+SNAPSHOT_HEADER = '#deduplicator-snapshot'
+SNAPSHOT_VERSION = 4
+FileStat = namedtuple('FileStat'
+        , ['st_size', 'st_mtime', 'st_mtime_ns', 'st_ino', 'st_dev'])
+DirListing = namedtuple('DirListing'
+        , ['dir_stat', 'subdirs', 'files', 'symlinks', 'program_files'
+            , 'stats', 'sized_out', 'pruned', 'excluded'])
+
+
+def fileStat(stat_result):
+    """return the FileStat fields of an os.stat_result"""
+    return FileStat(stat_result.st_size, stat_result.st_mtime
+            , stat_result.st_mtime_ns, stat_result.st_ino, stat_result.st_dev)
+
+
+class TreeSnapshot():
+    """the DirListing of each directory under root, keyed by path
+
+    subdirs and symlinks of a DirListing are lists of names, files is a dict
+    of the name and inode of each regular file, and stats a dict of the
+    FileStat of each file stat'ed. sized_out holds the name and inode of
+    the files left out by the size rules of scope, so a reused listing
+    finds them again if their size changed, and pruned and excluded the
+    names of the directories and files left out by its other rules. Files
+    named in ignore_names, or at root with a name containing one of
+    root_ignore_parts, are listed in program_files instead. Files are not
+    stat'ed unless stat_files is set, and not in a directory holding any of
+    stat_unless unless scope has size rules. fileStat() stats them when
+    needed. skipped holds the (pruned directories, files, bytes) left out of each
+    directory listed. A directory which can not be listed is left out, and
+    its path and error are added to errors. A lazy snapshot lists nothing
+    until walk() is called, and keeps no listing but the one last yielded.
+    """
+    def __init__(self, root, ignore_names=(), jobs=1, stat_files=True
+            , stat_unless=(), saved=None, scope=None, root_ignore_parts=()
+            , lazy=False):
+        self.root = root
+        self.scope = scope
+        self.root_dev = os.lstat(root).st_dev \
+                if scope is not None and scope.same_filesystem else None
+        self.skipped = []
+        self.errors = []
+        self.ignore_names = set(ignore_names)
+        self.root_ignore_parts = list(root_ignore_parts)
+        self.stat_files = stat_files
+        self.stat_unless = set(stat_unless)
+        self.saved = saved or {}
+        self.jobs = jobs
+        self.lazy = lazy
+        self.dirs = {}
+        self.reused_dirs = []
+        if not lazy:
+            for _ in self.walk():
+                pass
+
+    def walk(self):
+        """list root and every directory below it, and yield the (dir_path,
+        listing) of each as it is listed
+
+        listings are kept in dirs, or in a lazy snapshot only until the next
+        one is yielded.
+        """
+        for dir_path, listing in self.listings():
+            self.dirs[dir_path] = listing
+            yield dir_path, listing
+            if self.lazy:
+                del self.dirs[dir_path]
+
+    def listings(self):
+        """yield the (dir_path, listing) of root and each directory below it
+
+        directories are listed by a pool of jobs threads, at most 2 * jobs at
+        once. A directory removed before it was listed has no listing and is
+        left out.
+        """
+        dir_stack = [self.root]
+        if self.jobs < 2:
+            while dir_stack:
+                dir_path = dir_stack.pop()
+                listing = self.listDir(dir_path)
+                if listing is not None:
+                    dir_stack.extend(os.path.join(dir_path, name)
+                            for name in reversed(listing.subdirs))
+                    yield dir_path, listing
+            return
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            running = {}
+            while dir_stack or running:
+                while dir_stack and len(running) < 2 * self.jobs:
+                    dir_path = dir_stack.pop()
+                    running[pool.submit(self.listDir, dir_path)] = dir_path
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dir_path = running.pop(future)
+                    listing = future.result()
+                    if listing is not None:
+                        dir_stack.extend(os.path.join(dir_path, name)
+                                for name in reversed(listing.subdirs))
+                        yield dir_path, listing
+
+    def listDir(self, dir_path):
+        """return the DirListing of dir_path, or None if it does not exist
+
+        the entries of the saved listing are reused if the directory has the
+        same inode, device and mtime, but not the stats of its files. The
+        files excluded by scope are stat'ed to count their bytes.
+        """
+        try:
+            dir_stat = fileStat(os.lstat(dir_path))
+            saved_listing = self.saved.get(os.path.relpath(dir_path
+                , self.root))
+            if saved_listing is not None and saved_listing.dir_stat[2:] \
+                    == dir_stat[2:]:
+                self.reused_dirs.append(dir_path)
+                files = dict(saved_listing.files)
+                files.update(saved_listing.sized_out)
+                listing = saved_listing._replace(dir_stat=dir_stat
+                        , files=files, stats={}, sized_out={})
+            else:
+                listing = DirListing(dir_stat, [], {}, [], [], {}, {}, [], [])
+                self.scanEntries(dir_path, listing)
+            n_bytes = 0
+            for name in listing.excluded:
+                try:
+                    n_bytes += self.statFile(dir_path, name).st_size
+                except FileNotFoundError:
+                    pass
+            if self.stat_files and (not self.stat_unless.intersection(
+                listing.program_files) or self.scope is not None
+                    and self.scope.has_size):
+                for name in list(listing.files):
+                    try:
+                        file_stat = self.statFile(dir_path, name)
+                    except FileNotFoundError:
+                        del listing.files[name]
+                        continue
+                    if self.scope is not None and \
+                            self.scope.skipSize(file_stat.st_size):
+                        listing.sized_out[name] = listing.files.pop(name)
+                        n_bytes += file_stat.st_size
+                    else:
+                        listing.stats[name] = file_stat
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        except OSError as E:
+            self.errors.append((dir_path, E))
+            return None
+        n_files = len(listing.excluded) + len(listing.sized_out)
+        if listing.pruned or n_files:
+            self.skipped.append((len(listing.pruned), n_files, n_bytes))
+        return listing
+
+    def scanEntries(self, dir_path, listing):
+        """add the entries of dir_path to listing, with the directories and
+        files left out by scope in pruned and excluded
+        """
+        rel_dir = os.path.relpath(dir_path, self.root) \
+                if dir_path != self.root else ''
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if self.scope is not None and (self.scope.skipDir(
+                        os.path.join(rel_dir, entry.name))
+                        or self.otherDevice(entry)):
+                        listing.pruned.append(entry.name)
+                    else:
+                        listing.subdirs.append(entry.name)
+                elif entry.is_file(follow_symlinks=False):
+                    if entry.name in self.ignore_names or not rel_dir and any(
+                            part in entry.name
+                            for part in self.root_ignore_parts):
+                        listing.program_files.append(entry.name)
+                    elif self.scope is not None and self.scope.skipFile(
+                            os.path.join(rel_dir, entry.name)):
+                        listing.excluded.append(entry.name)
+                    else:
+                        listing.files[entry.name] = entry.inode()
+                elif entry.is_symlink():
+                    listing.symlinks.append(entry.name)
+
+    def otherDevice(self, entry):
+        """return True if the directory entry is on another device than root
+        and only one device is scanned
+        """
+        return self.root_dev is not None and \
+                entry.stat(follow_symlinks=False).st_dev != self.root_dev
+
+    @staticmethod
+    def statFile(dir_path, name):
+        return fileStat(os.stat(os.path.join(dir_path, name)
+            , follow_symlinks=False))
+
+    def fileStat(self, dir_path, name):
+        """return the FileStat of file name in dir_path, stat it if needed"""
+        stats = self.dirs[dir_path].stats
+        if name not in stats:
+            stats[name] = self.statFile(dir_path, name)
+        return stats[name]
+
+    def refreshDir(self, dir_path, written_names):
+        """take the stat of dir_path again after written_names were written
+        to it, so the next run can still reuse its listing
+        """
+        listing = self.dirs[dir_path]
+        listing.program_files.extend(name for name in written_names
+                if name not in listing.program_files)
+        self.dirs[dir_path] = listing._replace(
+                dir_stat=fileStat(os.lstat(dir_path)))
+
+    def numFiles(self):
+        return sum(len(listing.files) for listing in self.dirs.values())
+
+    def save(self):
+        """write the snapshot to SNAPSHOT_FILE at root
+
+        the header holds the key of scope, the snapshot is only reused with
+        the same rules. paths are relative to root. Each line holds the JSON
+        array of one directory: [path, dir_stat, subdirs, symlinks,
+        program_files, files, sized_out, pruned, excluded] with [name,
+        inode] for each file of files and sized_out.
+        The stats of files are not saved, they are taken again by each run.
+        """
+        snapshot_path = os.path.join(self.root, SNAPSHOT_FILE)
+        with open(snapshot_path, 'w', newline='') as snapshot_file:
+            snapshot_file.write('{} {} {}\n'.format(SNAPSHOT_HEADER
+                , SNAPSHOT_VERSION, scopeKey(self.scope)))
+            for dir_path, listing in self.dirs.items():
+                snapshot_file.write(json.dumps([os.path.relpath(dir_path
+                    , self.root), listing.dir_stat, listing.subdirs
+                    , listing.symlinks, listing.program_files
+                    , list(listing.files.items())
+                    , list(listing.sized_out.items()), listing.pruned
+                    , listing.excluded]
+                    , separators=(',', ':')))
+                snapshot_file.write('\n')
+
+
+def scopeKey(scope):
+    return '-' if scope is None else scope.key
+
+
+def loadSnapshot(root, scope=None):
+    """return a dict of the DirListings saved at root keyed by relative path
+
+    return an empty dict if there is no SNAPSHOT_FILE or it was written by
+    another version or with other scope rules.
+    """
+    saved = {}
+    try:
+        with open(os.path.join(root, SNAPSHOT_FILE), newline='') \
+                as snapshot_file:
+            if snapshot_file.readline().split() != [SNAPSHOT_HEADER
+                    , str(SNAPSHOT_VERSION), scopeKey(scope)]:
+                return saved
+            for line in snapshot_file:
+                rel_path, dir_stat, subdirs, symlinks, program_files, files \
+                        , sized_out, pruned, excluded = json.loads(line)
+                saved[rel_path] = DirListing(FileStat(*dir_stat), subdirs
+                        , dict(files), symlinks, program_files, {}
+                        , dict(sized_out), pruned, excluded)
+    except FileNotFoundError:
+        pass
+    return saved
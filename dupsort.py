@@ -0,0 +1,108 @@
+"""Sort more rows than fit in memory.
+
+Rows are buffered until their estimated size reaches the memory budget, then
+sorted and spilled to a run file in a temporary directory. The sorted rows
+are read back with a k-way merge of all runs, so only the buffer and one row
+of each run are held in memory. Runs are merged in several passes if there
+are more than max_open_runs of them. The merged rows may also be written to
+a single file, which is read back any number of times.
+"""
+import os
+import json
+import heapq
+import shutil
+import tempfile
+
+max_open_runs = 64
+row_overhead = 200
+
+
+class RunSorter():
+    def __init__(self, memory_mb, key, temp_dir=None):
+        self.budget = memory_mb * 1024 * 1024
+        self.key = key
+        self.temp_dir = temp_dir
+        self.run_dir = None
+        self.runs = []
+        self.buffer = []
+        self.buffer_size = 0
+
+    def add(self, row):
+        """add a tuple of JSON values, spill the buffer if it is full
+
+        the size of a row is estimated from the length of its strings.
+        """
+        self.buffer.append(row)
+        self.buffer_size += row_overhead + sum(len(field) for field in row
+                if isinstance(field, str))
+        if self.buffer_size >= self.budget:
+            self.spill()
+
+    def spill(self):
+        """write the sorted buffer to a new run file"""
+        self.buffer.sort(key=self.key)
+        self.runs.append(self.writeRun(self.buffer))
+        self.buffer = []
+        self.buffer_size = 0
+
+    def writeRun(self, rows):
+        if self.run_dir is None:
+            self.run_dir = tempfile.mkdtemp(prefix='deduplicator_runs_'
+                    , dir=self.temp_dir)
+        run_path = os.path.join(self.run_dir, 'run{}'.format(len(self.runs)))
+        while os.path.exists(run_path):
+            run_path += '_'
+        with open(run_path, 'w', encoding='utf-8', newline='') as run_file:
+            for row in rows:
+                run_file.write(json.dumps(row, separators=(',', ':')))
+                run_file.write('\n')
+        return run_path
+
+    @staticmethod
+    def readRun(run_path):
+        yield from RunSorter.readFile(run_path)
+        os.remove(run_path)
+
+    @staticmethod
+    def readFile(run_path):
+        """yield the rows of a run file, which is kept"""
+        with open(run_path, encoding='utf-8', newline='') as run_file:
+            for line in run_file:
+                yield tuple(json.loads(line))
+
+    def sortedRows(self):
+        """return an iterator of all rows added, sorted by key
+
+        rows are sorted in memory if no run was spilled.
+        """
+        if not self.runs:
+            self.buffer.sort(key=self.key)
+            return iter(self.buffer)
+        if self.buffer:
+            self.spill()
+        while len(self.runs) > max_open_runs:
+            merge_runs = self.runs[:max_open_runs]
+            del self.runs[:max_open_runs]
+            self.runs.append(self.writeRun(heapq.merge(*[self.readRun(run)
+                for run in merge_runs], key=self.key)))
+        return heapq.merge(*[self.readRun(run) for run in self.runs]
+                , key=self.key)
+
+    def sortedFile(self):
+        """write all rows added, sorted by key, to a single run file and
+        return its path
+
+        the file is read with readFile until close.
+        """
+        run_path = self.writeRun(self.sortedRows())
+        self.runs = []
+        self.buffer = []
+        self.buffer_size = 0
+        return run_path
+
+    def close(self):
+        """remove the run files"""
+        if self.run_dir is not None:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+            self.run_dir = None
+        self.buffer = []
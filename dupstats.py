@@ -0,0 +1,105 @@
+"""Time the phases of a build and report their counters.
+
+Each phase accumulates its elapsed time and counters for the files it
+handled, the bytes it read, the records it reused instead of reading files,
+and the errors it met. A phase may be entered many times, e.g. once per
+directory. Progress is printed to stderr at most every progress_interval
+seconds when stderr is a terminal, and the counters of all phases are
+written as a JSON report. Phases may also be profiled with cProfile, which
+only sees the calls made in the main thread.
+"""
+import os
+import sys
+import json
+import time
+import cProfile
+from contextlib import contextmanager
+
+progress_interval = 0.5
+COUNTERS = ['elapsed', 'files', 'bytes', 'cache_hits', 'errors']
+
+
+class BuildStats():
+    def __init__(self, profile_dir=None, progress=None):
+        self.phases = {}
+        self.profilers = {}
+        self.profile_dir = profile_dir
+        self.show_progress = sys.stderr.isatty() if progress is None \
+                else progress
+        self.start_time = time.perf_counter()
+        self.progress_time = 0
+        self.progress_len = 0
+
+    def counters(self, name):
+        """return the dict of counters of phase name"""
+        if name not in self.phases:
+            self.phases[name] = dict.fromkeys(COUNTERS, 0)
+        return self.phases[name]
+
+    @contextmanager
+    def phase(self, name):
+        """time a block as part of phase name and yield its counters"""
+        counters = self.counters(name)
+        profiler = None
+        if self.profile_dir is not None:
+            profiler = self.profilers.setdefault(name, cProfile.Profile())
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield counters
+        finally:
+            counters['elapsed'] += time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+
+    def progress(self, message):
+        """print message over the last progress line unless one was printed
+        within progress_interval
+        """
+        if not self.show_progress or \
+                time.monotonic() - self.progress_time < progress_interval:
+            return
+        self.progress_time = time.monotonic()
+        sys.stderr.write('\r' + message.ljust(self.progress_len))
+        sys.stderr.flush()
+        self.progress_len = len(message)
+
+    def endProgress(self):
+        """end the progress line, if any"""
+        if self.progress_len > 0:
+            sys.stderr.write('\n')
+            self.progress_len = 0
+            self.progress_time = 0
+
+    def report(self):
+        """return a dict of the counters and rates of each phase"""
+        phases = {}
+        for name, counters in self.phases.items():
+            phase = dict(counters)
+            elapsed = counters['elapsed']
+            phase['files_per_sec'] = counters['files'] / elapsed \
+                    if elapsed > 0 else None
+            phase['mb_per_sec'] = counters['bytes'] / elapsed / 1024 / 1024 \
+                    if elapsed > 0 else None
+            phases[name] = phase
+        return {'elapsed': time.perf_counter() - self.start_time
+                , 'phases': phases}
+
+    def writeReport(self, report_path, **fields):
+        """write report() with fields to report_path as JSON
+
+        the profile of each phase is written to profile_dir/<phase>.prof.
+        """
+        report = dict(fields, **self.report())
+        with open(report_path, 'w') as report_file:
+            json.dump(report, report_file, indent=1)
+            report_file.write('\n')
+        self.dumpProfiles()
+
+    def dumpProfiles(self):
+        if self.profile_dir is None:
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        for name, profiler in self.profilers.items():
+            profiler.dump_stats(os.path.join(self.profile_dir
+                , name.replace(' ', '_') + '.prof'))
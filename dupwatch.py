@@ -0,0 +1,257 @@
+"""Keep a ScanIndex current by following the inotify events of a tree.
+
+Linux only. inotify is called through ctypes, no other package or service is
+needed. Each event updates the database rows of the files it names, files are
+only checksummed when another row has the same size.
+"""
+import os
+import stat
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+from dupindex import SCAN_DATABASE
+
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+        | IN_CREATE | IN_DELETE | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+MAX_WATCHES_PATH = '/proc/sys/fs/inotify/max_user_watches'
+read_buffer_kb = 64
+
+
+class Inotify():
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            self.raiseErrno()
+
+    def raiseErrno(self, path=None):
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error), path)
+
+    def addWatch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            self.raiseErrno(path)
+        return wd
+
+    def removeWatch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def readEvents(self, timeout=None):
+        """return a list of (wd, mask, cookie, name) tuples
+
+        wait at most timeout seconds for an event, return an empty list if
+        none is received.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, read_buffer_kb * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, name_len = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b'\0')
+            offset += name_len
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class TreeWatcher():
+    def __init__(self, root, scan_index, hash_func, ignore_names=()):
+        self.root = root
+        self.scan_index = scan_index
+        self.hash_func = hash_func
+        self.ignore_names = set(ignore_names)
+        self.inotify = Inotify()
+        self.watches = {}
+        self.changed = False
+        try:
+            self.addTree(root)
+        except OSError:
+            self.inotify.close()
+            raise
+
+    def ignored(self, name):
+        return name in self.ignore_names or name.startswith(SCAN_DATABASE)
+
+    def relPath(self, path):
+        return os.path.relpath(path, self.root)
+
+    def addTree(self, path, scan=False):
+        """watch path and all of its subdirectories
+
+        each directory is watched before it is listed, so no file created
+        meanwhile is missed. If scan is set, update the row of each file and
+        directory. A directory which can not be watched or listed is
+        reported and left out. Raise an OSError naming the limit and how to
+        raise it once the inotify watches of the user run out, since a
+        subtree left unwatched would miss every change.
+        """
+        dir_stack = [path]
+        while dir_stack:
+            dir_path = dir_stack.pop()
+            try:
+                wd = self.inotify.addWatch(dir_path, WATCH_MASK)
+                entries = list(os.scandir(dir_path))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            except OSError as E:
+                if E.errno == errno.ENOSPC:
+                    raise OSError(E.errno, watchLimitMessage(len(
+                        self.watches)), dir_path) from E
+                print('watch error:', dir_path, '({})'.format(E.strerror))
+                continue
+            self.watches[wd] = dir_path
+            if scan and dir_path != self.root:
+                self.scan_index.setDir(self.relPath(dir_path))
+                self.changed = True
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dir_stack.append(entry.path)
+                elif scan and not self.ignored(entry.name):
+                    self.updateFile(entry.path)
+
+    def resync(self):
+        """update the row of every file in the tree and drop all others
+
+        used when the event queue overflowed and events were lost.
+        """
+        print('inotify queue overflowed, rescanning', self.root)
+        for wd in list(self.watches):
+            self.inotify.removeWatch(wd)
+        self.watches.clear()
+        self.addTree(self.root, scan=True)
+        for rel_path in self.scan_index.filePaths() \
+                + self.scan_index.dirPaths():
+            if not os.path.lexists(os.path.join(self.root, rel_path)):
+                self.scan_index.removePath(rel_path)
+        self.changed = True
+
+    def updateFile(self, path):
+        """bring the row of the file at path up to date with the file
+
+        the file is read only if its size, mtime or inode changed, no row
+        with the same inode has its checksum, and another row has its size.
+        Other rows of that size without a checksum are checksummed as well.
+        """
+        try:
+            file_stat = os.lstat(path)
+        except FileNotFoundError:
+            self.removePath(path)
+            return
+        if not stat.S_ISREG(file_stat.st_mode):
+            return
+        rel_path = self.relPath(path)
+        if self.scan_index.fileRow(rel_path) == (file_stat.st_ino
+                , file_stat.st_dev, file_stat.st_size, file_stat.st_mtime):
+            return
+        csum = 0 if file_stat.st_size == 0 else \
+                self.scan_index.inodeCsum(file_stat)
+        if csum is None:
+            same_size = [(other_path, other_csum) for other_path, other_csum
+                    in self.scan_index.sizeRows(file_stat.st_size)
+                    if other_path != rel_path]
+            try:
+                if len(same_size) > 0:
+                    csum = self.hash_func(path)
+            except FileNotFoundError:
+                self.removePath(path)
+                return
+            except OSError as E:
+                print('read error:', path, '({})'.format(E.strerror))
+            for other_path, other_csum in same_size:
+                if other_csum is None:
+                    try:
+                        self.scan_index.setCsum(other_path, self.hash_func(
+                            os.path.join(self.root, other_path)))
+                    except FileNotFoundError:
+                        self.scan_index.removePath(other_path)
+                    except OSError as E:
+                        print('read error:', other_path
+                                , '({})'.format(E.strerror))
+        self.scan_index.setRow(rel_path, file_stat, csum)
+        self.changed = True
+
+    def removePath(self, path):
+        """drop the rows of path and of all files below it"""
+        self.scan_index.removePath(self.relPath(path))
+        for wd, dir_path in list(self.watches.items()):
+            if dir_path == path or dir_path.startswith(path + os.sep):
+                self.inotify.removeWatch(wd)
+                del self.watches[wd]
+        self.changed = True
+
+    def movePath(self, old_path, new_path):
+        """rename the rows and watches of old_path and all files below it"""
+        self.scan_index.movePath(self.relPath(old_path)
+                , self.relPath(new_path))
+        for wd, dir_path in self.watches.items():
+            if dir_path == old_path or dir_path.startswith(old_path + os.sep):
+                self.watches[wd] = new_path + dir_path[len(old_path):]
+        self.changed = True
+
+    def readEvents(self, timeout=None):
+        """wait at most timeout seconds for events and apply them"""
+        events = self.inotify.readEvents(timeout)
+        moved = {}
+        for wd, mask, cookie, name in events:
+            if mask & IN_Q_OVERFLOW:
+                self.resync()
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches or not name or self.ignored(name):
+                continue
+            path = os.path.join(self.watches[wd], name)
+            if mask & IN_MOVED_FROM:
+                moved[cookie] = path
+            elif mask & IN_MOVED_TO and cookie in moved:
+                self.movePath(moved.pop(cookie), path)
+            elif mask & IN_DELETE:
+                self.removePath(path)
+            elif mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.addTree(path, scan=True)
+            else:
+                self.updateFile(path)
+        for path in moved.values():
+            self.removePath(path)
+        self.scan_index.commit()
+
+    def close(self):
+        self.inotify.close()
+
+
+def watchLimitMessage(n_watches):
+    """return the error of a tree needing more than the inotify watches
+    allowed, with the limit and how to raise it
+    """
+    try:
+        with open(MAX_WATCHES_PATH) as limit_file:
+            limit = limit_file.read().strip()
+    except OSError:
+        limit = 'unknown'
+    return ('inotify watch limit reached after {} directories (fs.inotify.'
+            'max_user_watches = {}, shared by every process of the user),'
+            ' raise it with: sysctl fs.inotify.max_user_watches=<N>'.format(
+                n_watches, limit))
@@ -0,0 +1,58 @@
+"""Cache the checksum of a file in an extended attribute of the file.
+
+The checksum is stored in the user.deduplicator attribute with the checksum
+algorithm, the size and the mtime of the file it was computed for, and is
+trusted while the size and mtime of the file still match. The attribute
+moves with the file, and is copied by cp --preserve=xattr and rsync -X (with
+the mtime by -p and -t), so moved and copied files are not read again.
+The ctime is not compared: renaming, copying and setting the attribute
+itself all change it. Filesystems or platforms without user attributes
+simply have no cache.
+"""
+import os
+
+XATTR_NAME = 'user.deduplicator'
+XATTR_VERSION = '1'
+XATTR = hasattr(os, 'getxattr')
+
+
+def readCsum(file_path, file_stat, algorithm):
+    """return the checksum cached for file_path or None
+
+    None is returned unless the attribute was written with algorithm for a
+    file with the size and mtime of file_stat.
+    """
+    if not XATTR:
+        return None
+    try:
+        value = os.getxattr(file_path, XATTR_NAME, follow_symlinks=False)
+    except OSError:
+        return None
+    try:
+        version, xattr_algorithm, csum, size, mtime_ns = \
+                value.decode().split()
+        if version == XATTR_VERSION and xattr_algorithm == algorithm \
+                and int(size) == file_stat.st_size \
+                and int(mtime_ns) == file_stat.st_mtime_ns:
+            return int(csum)
+    except ValueError:
+        pass
+    return None
+
+
+def writeCsum(file_path, file_stat, algorithm, csum):
+    """cache csum in the attribute of file_path
+
+    return False if the attribute could not be written, e.g. the file is
+    read only or its filesystem has no user attributes.
+    """
+    if not XATTR:
+        return False
+    value = ' '.join([XATTR_VERSION, algorithm, str(csum)
+        , str(file_stat.st_size), str(file_stat.st_mtime_ns)])
+    try:
+        os.setxattr(file_path, XATTR_NAME, value.encode()
+                , follow_symlinks=False)
+    except OSError:
+        return False
+    return True
@@ -0,0 +1,30 @@
+import os
+import sys
+import json
+import tempfile
+import subprocess
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class DupbenchRunTest(unittest.TestCase):
+    def test_run_absolute_path(self):
+        """run every step on a small tree at an absolute path"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            tree_path = os.path.join(temp_dir, 'bench')
+            output_path = os.path.join(temp_dir, 'results.jsonl')
+            subprocess.run([sys.executable
+                , os.path.join(REPO_DIR, 'dupbench.py'), tree_path, 'run'
+                , '--files', '50', '--depth', '2', '--fanout', '2'
+                , '--max-size', '16', '--output', output_path]
+                , cwd=temp_dir, check=True, stdout=subprocess.DEVNULL)
+            with open(output_path) as output_file:
+                result = json.loads(output_file.readline())
+        self.assertEqual(set(result['steps']), set(
+            ['build', 'build-none', 'build-light', 'build-full', 'index'
+                , 'list', 'delete', 'dirs', 'deemptydir', 'clean']))
+
+
+if __name__ == '__main__':
+    unittest.main()
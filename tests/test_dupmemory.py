@@ -0,0 +1,67 @@
+import os
+import sys
+import csv
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from dupbench import generateTree
+from dupfiles import SCAN_RECORD
+
+
+def treeRecords(tree_path):
+    """return a dict of the name, size, csum and dups of the rows of each
+    SCAN_RECORD below tree_path, keyed by relative path
+    """
+    records = {}
+    for dir_path, _, names in os.walk(tree_path):
+        if SCAN_RECORD in names:
+            with open(os.path.join(dir_path, SCAN_RECORD), newline='') \
+                    as record_file:
+                records[os.path.relpath(dir_path, tree_path)] = [
+                        (row[0], row[1], row[2], row[4])
+                        for row in csv.reader(record_file)]
+    return records
+
+
+class BoundedBuildTest(unittest.TestCase):
+    def build(self, tree_path, *args):
+        subprocess.run([sys.executable, os.path.join(REPO_DIR
+            , 'deduplicate.py'), tree_path, 'build'] + list(args)
+            , check=True, stdout=subprocess.DEVNULL)
+        with open(os.path.join(tree_path, 'deduplicator_summary')) \
+                as summary_file:
+            summary_file.readline()
+            return summary_file.read().replace(tree_path, '')
+
+    def test_same_as_in_memory(self):
+        """build with --memory 0 writes the summary and scan records of a
+        build in memory, on two trees written alike
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            index_path = os.path.join(temp_dir, 'indexed')
+            generateTree(index_path, 100, 1, 2, 512, 0.3, 0.1, 0.2, 8)
+            subprocess.run([sys.executable, os.path.join(REPO_DIR
+                , 'deduplicate.py'), index_path, 'index']
+                , check=True, stdout=subprocess.DEVNULL)
+            memory_path = os.path.join(temp_dir, 'memory')
+            bounded_path = os.path.join(temp_dir, 'bounded')
+            for tree_path in (memory_path, bounded_path):
+                generateTree(tree_path, 300, 2, 3, 512, 0.3, 0.1, 0.2, 7)
+                shutil.copy(os.path.join(index_path, 'deduplicator_index')
+                        , tree_path)
+            for args in ([], ['--light'], ['--full'], []):
+                self.assertEqual(self.build(bounded_path, '--memory', '0'
+                    , '-j', '3', *args), self.build(memory_path, *args))
+                self.assertEqual(treeRecords(bounded_path)
+                        , treeRecords(memory_path))
+            self.assertEqual(self.build(bounded_path, '--memory', '0'
+                , '--db'), self.build(memory_path, '--db'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+import zlib
+import signal
+import tempfile
+import subprocess
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from dupserve import query
+
+
+class ServeDatabaseTest(unittest.TestCase):
+    def test_lookup_unique_size(self):
+        """look up a file which build --db left without a checksum"""
+        contents = {'a.txt': b'unique size', 'b.txt': b'same', 'c.txt': b'same'}
+        with tempfile.TemporaryDirectory() as tree_path:
+            for name, data in contents.items():
+                with open(os.path.join(tree_path, name), 'wb') as out_file:
+                    out_file.write(data)
+            script = os.path.join(REPO_DIR, 'deduplicate.py')
+            subprocess.run([sys.executable, script, tree_path, 'build'
+                , '--db'], check=True, stdout=subprocess.DEVNULL)
+            socket_path = os.path.join(tree_path, 'serve.sock')
+            server = subprocess.Popen([sys.executable, script, tree_path
+                , 'serve', '--socket', socket_path], stdout=subprocess.DEVNULL)
+            try:
+                for _ in range(100):
+                    if os.path.exists(socket_path):
+                        break
+                    time.sleep(0.1)
+                response = query(socket_path, {'op': 'lookup', 'files': [
+                    [len(contents['a.txt']), zlib.crc32(contents['a.txt'])]]})
+                stats = query(socket_path, {'op': 'stats'})
+            finally:
+                server.send_signal(signal.SIGINT)
+                server.wait(10)
+            self.assertEqual(response, {'matches': [[
+                os.path.join(tree_path, 'a.txt')]]})
+            self.assertEqual(stats['files'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()